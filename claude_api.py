@@ -1,16 +1,32 @@
 import os
+import re
+import logging
 from openai import OpenAI
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from pinecone import Pinecone
+from pinecone.exceptions import PineconeProtocolError, ServiceException
 import openai
 import time
 import json
+import queue
+import random
+import heapq
+import operator
+import threading
+import unicodedata
+import hashlib
+from array import array
+import httpx
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import lru_cache
 from src.services.pinecone_organizer import extract_all_metadata, organize_results_by_metadata, format_organized_context
 from src.services.conversation_context import get_or_create_context
 from src.services.prompt_builder import build_system_prompt, PromptAssemblyError
-from src.services.type_injection import get_type_stack
+from src.services.type_injection import detect_types_in_message, get_type_stack
+from src.services.rag_cache import EmbeddingStore, SemanticCache, SingleFlight, TTLCache, question_key
 
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
@@ -20,37 +36,309 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_INDEX = os.getenv("PINECONE_INDEX")
 BRAVE_API_KEY = os.getenv("BRAVE_API_KEY")
+RAG_CACHE_DB = os.getenv("RAG_CACHE_DB")  # Optional SQLite file shared by all workers
+
+# Retrieval and web-search diagnostics go through this logger (messages are only
+# formatted when the level is enabled). Handler and level are set by the app.
+logger = logging.getLogger(__name__)
+
+# ===== PRECOMPUTED SSE FRAMES =====
+# Constant status events are built once at import instead of concatenated on
+# every yield. Kept as str (not bytes) because the route generators in main.py
+# inspect frames with substring checks before forwarding them.
+SSE_SEARCHING = 'data: {"status": "searching"}\n\n'
+SSE_GENERATING = 'data: {"status": "generating"}\n\n'
+SSE_MISSING_API_KEY = 'data: {"error": "OPENROUTER_API_KEY not set"}\n\n'
+
+# Response headers for routes streaming these frames. no-transform + identity
+# encoding keep proxies/compression middleware from buffering small frames,
+# X-Accel-Buffering disables nginx response buffering for the route.
+SSE_RESPONSE_HEADERS = {
+    "Cache-Control": "no-cache, no-transform",
+    "Connection": "keep-alive",
+    "Content-Encoding": "identity",
+    "X-Accel-Buffering": "no"
+}
+
+def sse(payload: dict) -> str:
+    """Build an SSE data frame for a dynamic payload (constant frames use the SSE_* strings above)."""
+    return "data: " + json.dumps(payload) + "\n\n"
+
+# C string escaper json.dumps uses for str values (ensure_ascii=True)
+_encode_json_string = json.encoder.encode_basestring_ascii
+
+def chunk_frame(text: str) -> str:
+    """SSE frame for one streamed text delta (same output as sse({"chunk": text}), without building a dict per token)"""
+    return 'data: {"chunk": ' + _encode_json_string(text) + '}\n\n'
+
+# Streamed text deltas are often a few characters each. They are merged into
+# one frame per STREAM_FLUSH_CHARS characters or STREAM_FLUSH_INTERVAL seconds,
+# whichever comes first, so the text still appears live with far fewer frames.
+STREAM_FLUSH_CHARS = 256
+STREAM_FLUSH_INTERVAL = 0.03
+
+class DeltaCoalescer:
+    """
+    Buffer streamed text deltas and hand back chunk frames when a flush is due.
+    The time bound is only checked when a delta arrives (add() for text, poll()
+    for anything else), so while the provider sends nothing at all, buffered
+    text waits for the next delta or the final flush().
+    """
+    
+    def __init__(self, max_chars: int = STREAM_FLUSH_CHARS, max_delay: float = STREAM_FLUSH_INTERVAL):
+        self.max_chars = max_chars
+        self.max_delay = max_delay
+        self._parts = []
+        self._chars = 0
+        self._last_flush = time.monotonic()
+    
+    def add(self, text: str) -> Optional[str]:
+        """Buffer a delta; returns a frame when the size or time bound is reached, else None"""
+        self._parts.append(text)
+        self._chars += len(text)
+        if self._chars >= self.max_chars or time.monotonic() - self._last_flush >= self.max_delay:
+            return self.flush()
+        return None
+    
+    def poll(self) -> Optional[str]:
+        """Frame for buffered text once the time bound has passed (call on deltas without text), else None"""
+        if self._parts and time.monotonic() - self._last_flush >= self.max_delay:
+            return self.flush()
+        return None
+    
+    def flush(self) -> Optional[str]:
+        """Frame for everything buffered (None when empty). Call before any non-text frame."""
+        self._last_flush = time.monotonic()
+        if not self._parts:
+            return None
+        frame = chunk_frame("".join(self._parts))
+        self._parts.clear()
+        self._chars = 0
+        return frame
+
+@lru_cache(maxsize=None)
+def status_frame(status: str) -> str:
+    """SSE frame for a status event, built once per status name."""
+    return sse({"status": status})
+
+# Status shown while each tool runs, keyed by tool name (tools without an entry
+# fall back to SSE_SEARCHING). Frames are built at import, not per event.
+TOOL_STATUS_FRAMES = {
+    "query_innerverse_backend": SSE_SEARCHING,
+    "query_reference_data": status_frame("looking_up_reference"),
+    "search_web": status_frame("searching_web"),
+}
+
+# Shared pool for running the tool calls of one model turn concurrently
+# (Pinecone, Brave and reference lookups are independent of each other)
+TOOL_WORKERS = 8
+_TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool-call")
+
+# Separate pool for I/O started from inside retrieval (which itself runs on
+# _TOOL_EXECUTOR, so sharing that pool could starve it)
+_RAG_IO_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix="rag-io")
+
+# The streaming RAG pre-fetch gets its own pool so it never waits behind tool calls
+PREFETCH_WORKERS = 16
+_PREFETCH_EXECUTOR = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="rag-prefetch")
+
+# Pinecone queries get their own pool, sized so every retrieval that can run at
+# once (one per tool or pre-fetch worker) has a thread for its query and never
+# queues behind another user's. Threads are only started when needed.
+PINECONE_QUERY_TIMEOUT = 10.0  # Seconds for one retrieval's query, retry included
+_PINECONE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=TOOL_WORKERS + PREFETCH_WORKERS, thread_name_prefix="pinecone"
+)
 
 # Load MBTI reference data at module level (loaded once on startup)
 try:
     with open('src/data/reference_data.json', 'r') as f:
         REFERENCE_DATA = json.load(f)
-    print("✅ [REFERENCE DATA] Loaded MBTI reference data successfully")
+    logger.info("✅ [REFERENCE DATA] Loaded MBTI reference data successfully")
 except FileNotFoundError:
-    print("⚠️ [REFERENCE DATA] reference_data.json not found - using Pinecone only")
+    logger.warning("⚠️ [REFERENCE DATA] reference_data.json not found - using Pinecone only")
     REFERENCE_DATA = {}
 except Exception as e:
-    print(f"⚠️ [REFERENCE DATA] Error loading reference_data.json: {e}")
+    logger.warning("⚠️ [REFERENCE DATA] Error loading reference_data.json: %s", e)
     REFERENCE_DATA = {}
 
+# Tool content when retrieval comes back empty
+NO_RESULTS_MESSAGE = "No relevant content found in knowledge base."
+
 # ===== EMBEDDING CACHE (RAG Optimization) =====
-# Stores embeddings for repeated questions to avoid re-computation
-# Bounded to prevent memory bloat
-_embedding_cache = {}
-_EMBEDDING_CACHE_MAX_SIZE = 100  # Max entries before eviction
-
-def get_cached_embedding(text: str) -> list | None:
-    """Get embedding from cache if exists."""
-    return _embedding_cache.get(text)
-
-def cache_embedding(text: str, embedding: list) -> None:
-    """Cache embedding with LRU-style eviction when at capacity."""
-    if len(_embedding_cache) >= _EMBEDDING_CACHE_MAX_SIZE:
-        # Remove oldest entry (first key in dict - Python 3.7+ maintains insertion order)
-        oldest_key = next(iter(_embedding_cache))
-        del _embedding_cache[oldest_key]
-        print(f"🗑️ [CACHE] Evicted oldest entry, cache size: {len(_embedding_cache)}")
-    _embedding_cache[text] = embedding
+# Stores embeddings for repeated questions to avoid re-computation.
+# LRU keyed by (model, digest of normalized text) so "What is INTJ?" and
+# "what is intj? " share an entry; bounded to prevent memory bloat. Vectors are
+# stored as packed float32 arrays: a 3072-dim list of Python floats costs ~100KB,
+# the array 12KB, so the full cache stays around 12MB.
+EMBEDDING_MODEL = "text-embedding-3-large"
+_embedding_cache = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+_EMBEDDING_CACHE_MAX_SIZE = 1024  # Max entries before the least recently used is evicted
+
+def _embedding_cache_key(text: str, model: str) -> tuple:
+    normalized = unicodedata.normalize("NFKC", text).strip().lower()
+    return model, hashlib.sha256(normalized.encode("utf-8")).digest()
+
+# With RAG_CACHE_DB set, embeddings are also written to that SQLite file so a
+# restarted (or sibling) worker skips the OpenAI round-trip for known questions
+_embedding_store = EmbeddingStore(RAG_CACHE_DB) if RAG_CACHE_DB else None
+
+def _embedding_store_key(key: tuple) -> bytes:
+    model, digest = key
+    return model.encode("utf-8") + b":" + digest
+
+def _remember_embedding(key: tuple, packed: array) -> None:
+    with _embedding_cache_lock:
+        _embedding_cache[key] = packed
+        _embedding_cache.move_to_end(key)
+        if len(_embedding_cache) > _EMBEDDING_CACHE_MAX_SIZE:
+            _embedding_cache.popitem(last=False)
+
+def get_cached_embedding(text: str, model: str = EMBEDDING_MODEL) -> list | None:
+    """Get embedding from cache if exists (marks it most recently used)."""
+    key = _embedding_cache_key(text, model)
+    with _embedding_cache_lock:
+        embedding = _embedding_cache.get(key)
+        if embedding is not None:
+            _embedding_cache.move_to_end(key)
+    if embedding is None and _embedding_store is not None:
+        embedding = _embedding_store.get(_embedding_store_key(key))
+        if embedding is not None:
+            _remember_embedding(key, embedding)
+    return embedding.tolist() if embedding is not None else None
+
+def cache_embedding(text: str, embedding: list, model: str = EMBEDDING_MODEL) -> None:
+    """Cache embedding with LRU eviction when at capacity."""
+    key = _embedding_cache_key(text, model)
+    packed = array("f", embedding)
+    _remember_embedding(key, packed)
+    if _embedding_store is not None:
+        _embedding_store.put(_embedding_store_key(key), packed)
+
+# ===== RETRIES FOR RETRIEVAL CALLS =====
+# Bursts of concurrent retrievals hit OpenAI 429s; one failed call used to drop
+# the whole retrieval (the answer then has no grounding). Transient errors are
+# retried with capped, jittered exponential backoff, and in-flight embedding
+# requests are bounded so a burst queues locally instead of at the API.
+_RETRIABLE_OPENAI_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    httpx.TimeoutException,
+)
+_EMBEDDING_SLOTS = threading.BoundedSemaphore(8)
+
+# Pinecone errors worth one more attempt: 5xx responses, dropped connections and
+# transport timeouts. 4xx errors (bad filter, auth) fail the same way every time.
+_RETRIABLE_PINECONE_ERRORS = (ServiceException, PineconeProtocolError, OSError)
+try:
+    from urllib3.exceptions import HTTPError as _Urllib3HTTPError
+    _RETRIABLE_PINECONE_ERRORS += (_Urllib3HTTPError,)
+except ImportError:  # Pinecone builds without the urllib3 transport
+    pass
+
+def is_transient_pinecone_error(error: Exception) -> bool:
+    """True for Pinecone failures a retry can fix (including 429 rate limits)"""
+    return isinstance(error, _RETRIABLE_PINECONE_ERRORS) or getattr(error, "status", None) == 429
+
+def call_with_retry(fn, *args, retry_on=(Exception,), attempts: int = 4,
+                    initial_delay: float = 0.25, max_delay: float = 4.0, **kwargs):
+    """Call fn, retrying `retry_on` errors with full-jitter exponential backoff."""
+    for attempt in range(attempts):
+        try:
+            return fn(*args, **kwargs)
+        except retry_on as e:
+            if attempt == attempts - 1:
+                raise
+            delay = random.uniform(0, min(max_delay, initial_delay * 2 ** attempt))
+            logger.warning("⚠️ [RETRY] %s failed (%s), attempt %d/%d, retrying in %.2fs",
+                           getattr(fn, "__name__", "call"), e, attempt + 1, attempts, delay)
+            time.sleep(delay)
+
+class TokenBucket:
+    """
+    Pace outbound calls to `rate` per second (bursts up to `capacity`), across threads.
+    Callers reserve a slot and sleep until it comes up instead of hitting the
+    provider at once and getting 429s.
+    """
+    
+    def __init__(self, rate: float, capacity: float = 1.0):
+        if not rate > 0:
+            raise ValueError(f"TokenBucket rate must be positive, got {rate!r}")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def reserve(self, max_wait: float) -> float | None:
+        """Take a slot and return the seconds to wait for it, or None if that exceeds max_wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1.0 - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            # Tokens may go negative: later callers queue behind this reservation
+            self._tokens -= 1.0
+            return wait
+    
+    def acquire(self, max_wait: float) -> bool:
+        wait = self.reserve(max_wait)
+        if wait is None:
+            return False
+        if wait:
+            time.sleep(wait)
+        return True
+
+@lru_cache()
+def _get_embeddings_client() -> OpenAI:
+    """OpenAI client for embeddings with SDK retries off (call_with_retry owns the retry budget)"""
+    return OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+
+def create_embeddings(texts) -> list:
+    """Embed one text or a list of texts; returns the embeddings in input order."""
+    with _EMBEDDING_SLOTS:
+        response = call_with_retry(
+            _get_embeddings_client().embeddings.create,
+            input=texts,
+            model=EMBEDDING_MODEL,
+            retry_on=_RETRIABLE_OPENAI_ERRORS
+        )
+    return [item.embedding for item in response.data]
+
+# ===== SEMANTIC RESULT CACHE (RAG Optimization) =====
+# Near-duplicate questions (cosine >= 0.95, same filters) reuse the previous
+# retrieval result instead of querying Pinecone again. TTL bounds staleness;
+# invalidate_rag_cache() drops everything after the knowledge base changes.
+# With RAG_CACHE_DB set, entries persist across restarts and are shared by workers.
+_rag_semantic_cache = SemanticCache(maxsize=256, ttl=600.0, threshold=0.95, db_path=RAG_CACHE_DB)
+
+# Exact repeats (same question modulo case/whitespace) are answered from this
+# per-process layer before filters, embedding lookup or the similarity scan.
+# It follows the semantic cache's clear generation, so a clear in any worker
+# sharing RAG_CACHE_DB empties it too.
+_rag_result_cache = TTLCache(maxsize=512, ttl=600.0, generation=_rag_semantic_cache.generation)
+
+# Identical questions arriving while the first retrieval is still running wait
+# for that result instead of issuing a second embedding + Pinecone query.
+_rag_inflight = SingleFlight()
+
+def invalidate_rag_cache() -> None:
+    """Clear cached retrieval results (call after upserting to Pinecone)."""
+    _rag_result_cache.clear()
+    _rag_semantic_cache.clear()
+
+def rag_cache_stats() -> Dict[str, Dict]:
+    """Hit/miss counts of the exact-question, semantic and web search caches (this worker)."""
+    return {
+        "exact": _rag_result_cache.stats(),
+        "semantic": _rag_semantic_cache.stats(),
+        "web": _brave_result_cache.stats(),
+    }
 
 PROJECTS = [
     {"id": "relationship-lab", "name": "💕 Relationship Lab", "emoji": "💕", "description": "Deep focus on golden pairs, compatibility, relationship dynamics"},
@@ -68,131 +356,164 @@ def get_db_connection():
         return None
     return psycopg2.connect(DATABASE_URL)
 
+@lru_cache()
 def get_pinecone_index():
-    """Get Pinecone index client"""
+    """Get Pinecone index client (singleton, so its connections are reused)"""
     if not PINECONE_API_KEY or not PINECONE_INDEX:
         return None
     pc = Pinecone(api_key=PINECONE_API_KEY)
     return pc.Index(PINECONE_INDEX)
 
+_FOLLOW_UP_RE = re.compile(r'\[FOLLOW-UP:\s*(.+?)\]', re.IGNORECASE)
+
 def extract_follow_up_question(text: str) -> str:
     """
     Extract follow-up question from Claude's response.
     Pattern: [FOLLOW-UP: question?]
     Returns: The extracted question string, or None if not found
     """
-    import re
-    follow_up_match = re.search(r'\[FOLLOW-UP:\s*(.+?)\]', text, re.IGNORECASE)
+    follow_up_match = _FOLLOW_UP_RE.search(text)
     if follow_up_match:
         return follow_up_match.group(1).strip()
     return None
 
+# Cognitive function codes as standalone words. "Ni hero", "Te parent" etc. are
+# covered too, since the code is a standalone word there as well.
+_FUNCTION_CODE_RE = re.compile(r'\b(NI|NE|SI|SE|TI|TE|FI|FE)\b')
+
 def detect_functions_in_message(text: str) -> List[str]:
     """
     Detect cognitive functions mentioned in message.
     Returns list of function codes (e.g., ['Ni', 'Te', 'Fi'])
     """
-    import re
-    
     if not text:
         return []
     
-    text_upper = text.upper()
-    functions = ['NI', 'NE', 'SI', 'SE', 'TI', 'TE', 'FI', 'FE']
-    detected = []
-    
-    for func in functions:
-        # Match function code as standalone word or with common suffixes
-        patterns = [
-            rf'\b{func}\b',  # Standalone: "Ni hero"
-            rf'\b{func} HERO\b',
-            rf'\b{func} PARENT\b',
-            rf'\b{func} CHILD\b',
-            rf'\b{func} INFERIOR\b',
-            rf'\b{func} NEMESIS\b',
-            rf'\b{func} CRITIC\b',
-            rf'\b{func} TRICKSTER\b',
-            rf'\b{func} DEMON\b',
-        ]
-        
-        if any(re.search(pattern, text_upper) for pattern in patterns):
-            detected.append(func.capitalize())
-    
-    return list(set(detected))  # Remove duplicates
+    # One scan of the text; the set removes duplicates
+    return list({func.capitalize() for func in _FUNCTION_CODE_RE.findall(text.upper())})
+
+# Query-intent keywords for re-ranking (substring match, same as `keyword in question`)
+_RELATIONSHIP_QUERY_RE = re.compile(r'relationship|compatible|interact|pair|together')
+_OCTAGRAM_QUERY_RE = re.compile(r'octagram|udsf|uduf|sdsf|sduf|developed|focused')
+_FUNCTION_QUERY_RE = re.compile(r'function|hero|parent|child|inferior|shadow')
+
+def _season_boost(season) -> float:
+    """Recent seasons (Season 20+) reflect the latest thinking"""
+    try:
+        season_num = int(season)
+    except (ValueError, TypeError):
+        return 0.0
+    if season_num >= 20:
+        return 0.06
+    if season_num >= 15:
+        return 0.03
+    return 0.0
 
 def rerank_chunks_with_metadata(chunks: List[Dict], user_question: str) -> List[Dict]:
     """
     Re-rank chunks using BOTH similarity score AND metadata relevance.
     Boosts chunks that match detected types, functions, and query intent.
     """
-    from src.services.type_injection import detect_types_in_message
-    
-    detected_types = detect_types_in_message(user_question)
-    detected_functions = detect_functions_in_message(user_question)
+    # Hashed once here so each chunk is a single set intersection
+    detected_types = frozenset(detect_types_in_message(user_question))
+    detected_functions = frozenset(detect_functions_in_message(user_question))
     question_lower = user_question.lower()
     
+    # Query intent depends only on the question, so the content_type rules that
+    # apply are picked once: (content_type keywords, boost) checked per chunk
+    intent_boosts = []
+    if _RELATIONSHIP_QUERY_RE.search(question_lower):
+        intent_boosts.append((('relationship',), 0.10))
+    if _OCTAGRAM_QUERY_RE.search(question_lower):
+        intent_boosts.append((('octagram', 'development'), 0.15))
+    if _FUNCTION_QUERY_RE.search(question_lower):
+        intent_boosts.append((('function', 'cognitive'), 0.08))
+    if len(detected_types) >= 2:  # Type comparison queries
+        intent_boosts.append((('comparison', 'dynamics'), 0.10))
+    
     for chunk in chunks:
-        base_score = chunk.get('score', 0.0)
         boost = 0.0
         
-        # Boost if types match (strongest signal)
-        chunk_types = chunk.get('types_discussed', [])
-        if chunk_types and detected_types:
-            matching_types = set(chunk_types) & set(detected_types)
-            if matching_types:
-                boost += 0.12 * len(matching_types)  # Up to +0.24 for 2 types
+        # Boost if types match (strongest signal, up to +0.24 for 2 types)
+        if detected_types:
+            boost += 0.12 * len(detected_types.intersection(chunk.get('types_discussed') or ()))
         
         # Boost if functions match
-        chunk_functions = chunk.get('functions_covered', [])
-        if chunk_functions and detected_functions:
-            matching_funcs = set(chunk_functions) & set(detected_functions)
-            if matching_funcs:
-                boost += 0.08 * len(matching_funcs)
-        
-        # Boost recent seasons (Season 20+ reflects latest thinking)
-        season_str = chunk.get('season', '')
-        if season_str:
-            try:
-                season_num = int(season_str)
-                if season_num >= 20:
-                    boost += 0.06
-                elif season_num >= 15:
-                    boost += 0.03
-            except (ValueError, TypeError):
-                pass
-        
-        # Boost if content_type matches query intent
-        content_type = chunk.get('content_type', '').lower()
-        
-        # Relationship queries
-        if any(keyword in question_lower for keyword in ['relationship', 'compatible', 'interact', 'pair', 'together']):
-            if 'relationship' in content_type:
-                boost += 0.10
+        if detected_functions:
+            boost += 0.08 * len(detected_functions.intersection(chunk.get('functions_covered') or ()))
         
-        # Octagram queries
-        if any(keyword in question_lower for keyword in ['octagram', 'udsf', 'uduf', 'sdsf', 'sduf', 'developed', 'focused']):
-            if 'octagram' in content_type or 'development' in content_type:
-                boost += 0.15
-        
-        # Function-specific queries
-        if any(keyword in question_lower for keyword in ['function', 'hero', 'parent', 'child', 'inferior', 'shadow']):
-            if 'function' in content_type or 'cognitive' in content_type:
-                boost += 0.08
+        season = chunk.get('season', '')
+        if season:
+            boost += _season_boost(season)
         
-        # Type comparison queries
-        if len(detected_types) >= 2:
-            if 'comparison' in content_type or 'dynamics' in content_type:
-                boost += 0.10
+        # Boost if content_type matches query intent
+        if intent_boosts:
+            content_type = chunk.get('content_type', '').lower()
+            for keywords, intent_boost in intent_boosts:
+                if any(keyword in content_type for keyword in keywords):
+                    boost += intent_boost
         
         # Apply boost (cap at 1.0)
-        chunk['boosted_score'] = min(1.0, base_score + boost)
+        chunk['boosted_score'] = min(1.0, chunk.get('score', 0.0) + boost)
         chunk['boost_applied'] = boost
     
     # Re-sort by boosted score
-    chunks.sort(key=lambda x: x.get('boosted_score', x.get('score', 0.0)), reverse=True)
+    chunks.sort(key=operator.itemgetter('boosted_score'), reverse=True)
     
     return chunks
 
+# Context budget for the chunks injected into the prompt. tiktoken isn't a
+# dependency, so tokens are estimated at ~4 characters each (8000 tokens).
+RAG_CONTEXT_MAX_CHARS = 32_000
+RAG_CONTEXT_MAX_CHUNKS = 8
+RAG_CHUNK_MAX_CHARS = 2_000  # ~500 tokens per excerpt
+
+def trim_chunk_text(text: str, max_chars: int = RAG_CHUNK_MAX_CHARS) -> str:
+    """Shorten an excerpt to max_chars, ending on a sentence boundary when one is near"""
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    sentence_end = max(cut.rfind(". "), cut.rfind("? "), cut.rfind("! "))
+    if sentence_end >= max_chars // 2:
+        return cut[:sentence_end + 1]
+    return cut.rstrip() + "…"
+
+def select_context_chunks(
+    ranked_chunks: List[Dict],
+    max_chunks: int = RAG_CONTEXT_MAX_CHUNKS,
+    max_chars: int = RAG_CONTEXT_MAX_CHARS,
+    max_overlap: float = 0.9,
+) -> List[Dict]:
+    """
+    Pick context chunks in rank order, skipping near-duplicates and stopping at the budget.
+    
+    A chunk is a near-duplicate when its word set overlaps an already selected
+    chunk by more than max_overlap (Jaccard) - overlapping transcript windows
+    add tokens without adding grounding. The best chunk is always kept.
+    Oversized excerpts are trimmed to RAG_CHUNK_MAX_CHARS first.
+    """
+    selected = []
+    selected_words = []
+    total_chars = 0
+    
+    for chunk in ranked_chunks:
+        if len(selected) >= max_chunks:
+            break
+        
+        text = trim_chunk_text(chunk.get('text', ''))
+        if selected and total_chars + len(text) > max_chars:
+            break
+        
+        words = frozenset(text.lower().split())
+        if any(len(words & seen) > max_overlap * len(words | seen) for seen in selected_words):
+            continue
+        
+        selected.append(chunk if text is chunk.get('text') else {**chunk, 'text': text})
+        selected_words.append(words)
+        total_chars += len(text)
+    
+    return selected
+
 def format_rag_context_professional(sorted_chunks: List[Dict]) -> str:
     """
     Format RAG chunks with full metadata for Claude accuracy.
@@ -324,6 +645,9 @@ def format_citations(chunks: list) -> str:
     return "\n".join(citations) if citations else "No sources available"
 
 
+_MBTI_TYPE_RE = re.compile(r'\b(INTJ|INTP|ENTJ|ENTP|INFJ|INFP|ENFJ|ENFP|ISTJ|ISFJ|ESTJ|ESFJ|ISTP|ISFP|ESTP|ESFP)\b')
+_SEASON_RE = re.compile(r'season\s*(\d+)', re.IGNORECASE)
+
 def extract_filters_from_query(query: str) -> dict:
     """
     Extract Pinecone filters from user query using FAST regex (no GPT call).
@@ -337,28 +661,37 @@ def extract_filters_from_query(query: str) -> dict:
     Returns:
         Dict of Pinecone filters (empty dict if no filters extracted)
     """
-    import re
-    
     filters = {}
     query_upper = query.upper()
     
     # Extract MBTI types mentioned (instant regex, no API call)
-    mbti_types = re.findall(r'\b(INTJ|INTP|ENTJ|ENTP|INFJ|INFP|ENFJ|ENFP|ISTJ|ISFJ|ESTJ|ESFJ|ISTP|ISFP|ESTP|ESFP)\b', query_upper)
+    mbti_types = _MBTI_TYPE_RE.findall(query_upper)
     if mbti_types:
         # Deduplicate while preserving order
         unique_types = list(dict.fromkeys(mbti_types))
         filters["types_discussed"] = {"$in": unique_types}
-        print(f"🎯 [FAST-FILTER] Detected types: {unique_types}")
+        logger.debug("🎯 [FAST-FILTER] Detected types: %s", unique_types)
     
     # Extract season if explicitly mentioned
-    season_match = re.search(r'season\s*(\d+)', query, re.IGNORECASE)
+    season_match = _SEASON_RE.search(query)
     if season_match:
         filters["season"] = {"$eq": season_match.group(1)}
-        print(f"🎯 [FAST-FILTER] Detected season: {season_match.group(1)}")
+        logger.debug("🎯 [FAST-FILTER] Detected season: %s", season_match.group(1))
     
     return filters
 
 
+_JSON_FENCE_RE = re.compile(r'```(?:json)?\s*(.*?)\s*```', re.DOTALL)
+
+def parse_fenced_json(text: str):
+    """json.loads a model reply, unwrapping a ```json markdown fence if present"""
+    text = text.strip()
+    if text[:1] in ('[', '{'):  # Common case: bare JSON, nothing to search for
+        return json.loads(text)
+    fence_match = _JSON_FENCE_RE.search(text)
+    return json.loads(fence_match.group(1) if fence_match else text)
+
+
 def expand_query(original_query: str) -> list:
     """
     Generate multiple query variations for better recall using GPT-4o-mini.
@@ -399,40 +732,53 @@ Return as JSON array of strings (2-3 variations only):"""
             max_tokens=200  # Reduced for faster response
         )
         
-        response_text = response.choices[0].message.content.strip()
-        
-        # Try to extract JSON if wrapped in markdown
-        if "```json" in response_text:
-            json_start = response_text.find("```json") + 7
-            json_end = response_text.find("```", json_start)
-            response_text = response_text[json_start:json_end].strip()
-        elif "```" in response_text:
-            json_start = response_text.find("```") + 3
-            json_end = response_text.find("```", json_start)
-            response_text = response_text[json_start:json_end].strip()
-        
-        variations = json.loads(response_text)
+        variations = parse_fenced_json(response.choices[0].message.content)
         
         # Validate it's a list
         if not isinstance(variations, list):
-            print(f"⚠️ [QUERY-EXPANSION] GPT returned non-list: {type(variations)}")
+            logger.warning("⚠️ [QUERY-EXPANSION] GPT returned non-list: %s", type(variations))
             return [original_query]
         
         # Add original query
         all_queries = [original_query] + variations
-        print(f"🔍 [QUERY-EXPANSION] Expanded to {len(all_queries)} queries: {all_queries}")
+        logger.debug("🔍 [QUERY-EXPANSION] Expanded to %d queries: %s", len(all_queries), all_queries)
         
         return all_queries[:3]  # Cap at 3 total (original + 2 variations) for faster processing
         
     except json.JSONDecodeError as e:
-        print(f"⚠️ [QUERY-EXPANSION] JSON parsing failed: {e}")
+        logger.warning("⚠️ [QUERY-EXPANSION] JSON parsing failed: %s", e)
         return [original_query]
     except Exception as e:
-        print(f"⚠️ [QUERY-EXPANSION] Query expansion failed: {e}")
+        logger.warning("⚠️ [QUERY-EXPANSION] Query expansion failed: %s", e)
         return [original_query]
 
 
-def query_innerverse_local(question: str, progress_callback=None) -> str:
+# Unique chunks (by base score) handed to the metadata re-ranker
+RERANK_CANDIDATES = 20
+
+def query_innerverse_local(question: str, progress_callback=None, use_cache: bool = True) -> str:
+    """
+    Knowledge-base retrieval for a question (see _query_innerverse_local).
+    Concurrent calls for the same question share one retrieval; callers that
+    joined an in-flight call receive no progress callbacks.
+    Pass use_cache=False to bypass the semantic result cache (nothing is read or stored).
+    """
+    if not use_cache:
+        return _query_innerverse_local(question, progress_callback, use_cache=False)
+    
+    key = question_key(question)
+    cached_result = _rag_result_cache.get(key)
+    if cached_result is not None:
+        logger.debug("⚡ [RESULT CACHE HIT] Reusing retrieval for repeated question")
+        return cached_result
+    
+    result = _rag_inflight.do(key, lambda: _query_innerverse_local(question, progress_callback))
+    # Only full results are cached; failures return "" and are retried next time
+    if isinstance(result, tuple):
+        _rag_result_cache.put(key, result)
+    return result
+
+def _query_innerverse_local(question: str, progress_callback=None, use_cache: bool = True) -> str:
     """
     IMPROVED HYBRID SEARCH for MBTI content:
     - Upgraded to text-embedding-3-large for better semantic matching
@@ -442,28 +788,27 @@ def query_innerverse_local(question: str, progress_callback=None) -> str:
     - Re-ranking for relevance
     """
     try:
-        print(f"\n🔍 [CLAUDE DEBUG] Query: '{question}'")
-        print(f"📍 [CLAUDE DEBUG] Using Pinecone index: {PINECONE_INDEX}")
-        print(f"🔑 [CLAUDE DEBUG] OpenAI API Key: {'✅ SET' if OPENAI_API_KEY else '❌ MISSING'}")
-        print(f"🔑 [CLAUDE DEBUG] Pinecone API Key: {'✅ SET' if PINECONE_API_KEY else '❌ MISSING'}")
+        logger.debug("🔍 [CLAUDE DEBUG] Query: '%s'", question)
+        logger.debug("📍 [CLAUDE DEBUG] Using Pinecone index: %s", PINECONE_INDEX)
+        logger.debug("🔑 [CLAUDE DEBUG] OpenAI API Key: %s", '✅ SET' if OPENAI_API_KEY else '❌ MISSING')
+        logger.debug("🔑 [CLAUDE DEBUG] Pinecone API Key: %s", '✅ SET' if PINECONE_API_KEY else '❌ MISSING')
         
         if not OPENAI_API_KEY:
-            print("❌ [CLAUDE DEBUG] OpenAI API key missing!")
+            logger.error("❌ [CLAUDE DEBUG] OpenAI API key missing!")
             return ""
         
         openai.api_key = OPENAI_API_KEY
         pinecone_index = get_pinecone_index()
         if not pinecone_index:
-            print("❌ [CLAUDE DEBUG] Failed to get Pinecone index!")
+            logger.error("❌ [CLAUDE DEBUG] Failed to get Pinecone index!")
             return ""
         
-        print(f"✅ [CLAUDE DEBUG] Pinecone index connected successfully")
+        logger.debug("✅ [CLAUDE DEBUG] Pinecone index connected successfully")
         
         if progress_callback:
             progress_callback("searching")
         
         import time as _time  # Local import for timing
-        from concurrent.futures import ThreadPoolExecutor
         
         # Check embedding cache first
         cached_embedding = get_cached_embedding(question)
@@ -475,109 +820,126 @@ def query_innerverse_local(question: str, progress_callback=None) -> str:
             # Cache hit: Only need filter extraction (fast)
             query_vector = cached_embedding
             metadata_filters = extract_filters_from_query(question)
-            print(f"⚡ [CACHE HIT] Using cached embedding, filters extracted in {_time.time() - parallel_start:.3f}s")
+            logger.debug("⚡ [CACHE HIT] Using cached embedding, filters extracted in %.3fs", _time.time() - parallel_start)
         else:
             # Cache miss: Run filter extraction + embedding in PARALLEL
-            print(f"🔄 [PARALLEL] Running filter extraction + embedding concurrently...")
-            
-            def create_embedding():
-                response = openai.embeddings.create(
-                    input=question,
-                    model="text-embedding-3-large"
-                )
-                return response.data[0].embedding
+            logger.debug("🔄 [PARALLEL] Running filter extraction + embedding concurrently...")
             
             try:
-                with ThreadPoolExecutor(max_workers=2) as executor:
-                    filter_future = executor.submit(extract_filters_from_query, question)
-                    embed_future = executor.submit(create_embedding)
-                    
-                    # Collect results (waits for both to complete)
-                    metadata_filters = filter_future.result(timeout=5.0)  # Filters should be instant
-                    query_vector = embed_future.result(timeout=30.0)  # Embedding might take longer
+                # Embed on the shared pool while filters are extracted on this thread
+                embed_future = _RAG_IO_EXECUTOR.submit(create_embeddings, question)
+                metadata_filters = extract_filters_from_query(question)
+                query_vector = embed_future.result(timeout=30.0)[0]
                 
                 # Cache the embedding for future use
                 cache_embedding(question, query_vector)
                 parallel_time = _time.time() - parallel_start
-                print(f"✅ [PARALLEL] Completed in {parallel_time:.2f}s (filter + embedding concurrent)")
+                logger.debug("✅ [PARALLEL] Completed in %.2fs (filter + embedding concurrent)", parallel_time)
             except Exception as e:
                 # Fallback to sequential on parallel failure
-                print(f"⚠️ [PARALLEL] Failed ({e}), falling back to sequential...")
+                logger.warning("⚠️ [PARALLEL] Failed (%s), falling back to sequential...", e)
                 metadata_filters = extract_filters_from_query(question)
-                response = openai.embeddings.create(input=question, model="text-embedding-3-large")
-                query_vector = response.data[0].embedding
+                query_vector = create_embeddings(question)[0]
                 cache_embedding(question, query_vector)
         
-        # Single query mode (no expansion for speed)
-        print(f"⚡ [SPEED MODE] Using single query (no expansion) for fastest response")
+        # Semantic cache: a near-duplicate question retrieved with the same filters
+        # reuses the earlier result and skips Pinecone entirely
+        cache_scope = json.dumps([metadata_filters, sorted(detect_functions_in_message(question))], sort_keys=True)
+        cached_result = _rag_semantic_cache.get(query_vector, scope=cache_scope) if use_cache else None
+        if cached_result is not None:
+            logger.debug("⚡ [SEMANTIC CACHE HIT] Reusing retrieval for near-duplicate question")
+            # Persisted entries come back from JSON as lists
+            context, cached_citations = cached_result
+            return context, cached_citations
         
+        # Single query mode (no expansion for speed)
+        logger.debug("⚡ [SPEED MODE] Using single query (no expansion) for fastest response")
+
         # Optimized retrieval (top_k=15) - we only use 8 chunks, buffer for filtering
-        all_chunks = {}  # Deduplicate by text
+        query_params = {
+            "vector": query_vector,
+            "top_k": 15,
+            "include_metadata": True
+        }
         
-        # Process the single query
-        for query_idx, query in enumerate([question], 1):
-            if progress_callback:
-                progress_callback(f"searching_pinecone")
-            
-            # Query Pinecone with INCREASED top_k for hybrid approach + metadata filters
-            query_params = {
-                "vector": query_vector,
-                "top_k": 15,
-                "include_metadata": True
-            }
-            
-            # FEATURE #1: Apply metadata filters if extracted
-            if metadata_filters:
-                query_params["filter"] = metadata_filters
-                print(f"🎯 [METADATA-FILTER] Applying filters to query #{query_idx}: {metadata_filters}")
-            
-            pinecone_start = _time.time()
-            print(f"📡 [CLAUDE DEBUG] Querying Pinecone with top_k=15...")
-            try:
-                from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
-                
-                # Wrap Pinecone query with 10-second timeout
-                with ThreadPoolExecutor() as executor:
-                    future = executor.submit(
-                        pinecone_index.query,
-                        **query_params
-                    )
-                    query_response = future.result(timeout=10.0)
-                pinecone_time = _time.time() - pinecone_start
-                print(f"⏱️ [TIMING] Pinecone query took {pinecone_time:.2f}s")
-            except (FuturesTimeoutError, TimeoutError) as e:
-                print(f"⏱️ [CLAUDE DEBUG] Pinecone query #{query_idx} timed out after 10 seconds")
-                continue  # Skip this query and try next one
-            
-            # Extract and deduplicate contexts
+        # FEATURE #1: Apply metadata filters if extracted
+        if metadata_filters:
+            query_params["filter"] = metadata_filters
+            logger.debug("🎯 [METADATA-FILTER] Applying filters: %s", metadata_filters)
+
+        if progress_callback:
+            progress_callback(f"searching_pinecone")
+        
+        pinecone_start = _time.time()
+        logger.debug("📡 [CLAUDE DEBUG] Querying Pinecone with top_k=15...")
+        query_response = None
+        try:
+            query_response = _PINECONE_EXECUTOR.submit(
+                pinecone_index.query, **query_params, _request_timeout=PINECONE_QUERY_TIMEOUT
+            ).result(timeout=PINECONE_QUERY_TIMEOUT)
+        except FutureTimeoutError:
+            logger.warning("⏱️ [CLAUDE DEBUG] Pinecone query timed out after %.0f seconds", PINECONE_QUERY_TIMEOUT)
+        except Exception as e:
+            remaining = PINECONE_QUERY_TIMEOUT - (_time.time() - pinecone_start)
+            if not is_transient_pinecone_error(e) or remaining < 1.0:
+                logger.error("❌ [CLAUDE DEBUG] Pinecone query failed: %s", e)
+            else:
+                # Transient error: one retry within what is left of the budget
+                logger.warning("⚠️ [CLAUDE DEBUG] Pinecone query failed (%s), retrying", e)
+                try:
+                    query_response = pinecone_index.query(**query_params, _request_timeout=remaining)
+                except Exception as retry_error:
+                    logger.error("❌ [CLAUDE DEBUG] Pinecone query failed after retry: %s", retry_error)
+        
+        pinecone_time = _time.time() - pinecone_start
+        logger.debug("⏱️ [TIMING] Pinecone query took %.2fs", pinecone_time)
+        
+        # Extract and deduplicate contexts
+        matches = []
+        if query_response is not None:
             try:
                 matches = query_response.matches
             except AttributeError:
                 matches = query_response.get("matches", [])
-            
-            print(f"📊 [CLAUDE DEBUG] Query #{query_idx} returned {len(matches)} matches")
-            if matches:
-                print(f"   Top match score: {matches[0].score:.4f}")
-                print(f"   Lowest match score: {matches[-1].score:.4f}")
-            
-            # Extract ALL metadata (including 10 enriched fields)
-            enriched_results = extract_all_metadata(matches)
-            
-            for result in enriched_results:
-                text = result['text']
-                if text and text not in all_chunks:
-                    all_chunks[text] = result
         
-        if not all_chunks:
-            print("❌ [CLAUDE DEBUG] No chunks found! Returning empty message.")
+        logger.debug("📊 [CLAUDE DEBUG] Query returned %d matches", len(matches))
+        if matches:
+            logger.debug("   Top match score: %.4f", matches[0].score)
+            logger.debug("   Lowest match score: %.4f", matches[-1].score)
+        
+        # Dedupe by a hash of the text (not the multi-KB text itself) and keep only
+        # the best RERANK_CANDIDATES in a bounded min-heap while collecting
+        seen_texts = set()
+        top_chunks = []  # (score, -arrival, chunk); -arrival keeps first-seen order on ties
+        
+        # Extract ALL metadata (including 10 enriched fields)
+        for result in extract_all_metadata(matches):
+            text = result['text']
+            if not text:
+                continue
+            text_hash = hash(text)
+            if text_hash in seen_texts:
+                continue
+            seen_texts.add(text_hash)
+            entry = (result['score'], -len(seen_texts), result)
+            if len(top_chunks) < RERANK_CANDIDATES:
+                heapq.heappush(top_chunks, entry)
+            else:
+                heapq.heappushpop(top_chunks, entry)
+        
+        if not top_chunks:
+            logger.info("❌ [CLAUDE DEBUG] No chunks found! Returning empty message.")
             return "No relevant MBTI content found in knowledge base."
         
+        if progress_callback:
+            progress_callback("ranking")
+        
         # IMPROVEMENT 3: Metadata-boosted re-ranking
         # Sort by base score, apply metadata boosts, re-sort, take top 12
-        sorted_chunks = sorted(all_chunks.values(), key=lambda x: x["score"], reverse=True)[:20]  # Get top 20 first
+        sorted_chunks = [chunk for _, _, chunk in sorted(top_chunks, reverse=True)]  # Top 20 by base score
         
-        print(f"📚 [CLAUDE DEBUG] Total unique chunks collected: {len(all_chunks)}")
-        print(f"🔄 [CLAUDE DEBUG] Applying metadata-boosted re-ranking...")
+        logger.debug("📚 [CLAUDE DEBUG] Total unique chunks collected: %d", len(seen_texts))
+        logger.debug("🔄 [CLAUDE DEBUG] Applying metadata-boosted re-ranking...")
         
         # Apply intelligent re-ranking
         reranked_chunks = rerank_chunks_with_metadata(sorted_chunks, question)
@@ -586,23 +948,25 @@ def query_innerverse_local(question: str, progress_callback=None) -> str:
         # Metadata boosting provides 80% of the quality benefit at zero latency cost
         # GPT re-ranking was adding 8-10s for marginal improvement
         # SPEED OPTIMIZATION: Reduced from 12 to 8 chunks (saves ~5s Claude processing)
-        final_chunks = reranked_chunks[:8]  # Use metadata-boosted chunks directly
+        # Near-duplicates are skipped and the total is capped at RAG_CONTEXT_MAX_CHARS
+        final_chunks = select_context_chunks(reranked_chunks)  # Use metadata-boosted chunks directly
         top_3_avg_score = sum(c.get('boosted_score', c.get('score', 0.0)) for c in final_chunks[:3]) / 3
-        print(f"⚡ [CLAUDE DEBUG] Using metadata-boosted chunks (avg score: {top_3_avg_score:.3f}) - GPT re-ranking disabled for speed")
+        logger.debug("⚡ [CLAUDE DEBUG] Using metadata-boosted chunks (avg score: %.3f) - GPT re-ranking disabled for speed", top_3_avg_score)
         
         # Log boost details
         boosted_count = sum(1 for c in final_chunks if c.get('boost_applied', 0) > 0)
-        print(f"📈 [CLAUDE DEBUG] {boosted_count}/{len(final_chunks)} chunks received metadata boost")
+        logger.debug("📈 [CLAUDE DEBUG] %d/%d chunks received metadata boost", boosted_count, len(final_chunks))
         if boosted_count > 0:
             avg_boost = sum(c.get('boost_applied', 0) for c in final_chunks) / len(final_chunks)
-            print(f"📈 [CLAUDE DEBUG] Average boost: +{avg_boost:.3f}")
+            logger.debug("📈 [CLAUDE DEBUG] Average boost: +%.3f", avg_boost)
         
-        print(f"📚 [CLAUDE DEBUG] Top 8 chunks selected for context")
-        print(f"📚 [CLAUDE DEBUG] Sample sources: {', '.join(set([c.get('season', 'Unknown') for c in final_chunks[:5] if c.get('season')]))}")
+        logger.debug("📚 [CLAUDE DEBUG] Top %d chunks selected for context (%d chars)", len(final_chunks), sum(len(c['text']) for c in final_chunks))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("📚 [CLAUDE DEBUG] Sample sources: %s", ', '.join(set([c.get('season', 'Unknown') for c in final_chunks[:5] if c.get('season')])))
         
         # FEATURE #4: Calculate confidence score
         confidence = calculate_confidence_score(final_chunks, question)
-        print(f"📊 [CONFIDENCE] {confidence['stars']} {confidence['level']} ({confidence['score']:.2f}) - {confidence['reasoning']}")
+        logger.debug("📊 [CONFIDENCE] %s %s (%.2f) - %s", confidence['stars'], confidence['level'], confidence['score'], confidence['reasoning'])
         
         # FEATURE #4: Format citations for display
         citations_text = format_citations(final_chunks)
@@ -631,82 +995,406 @@ def query_innerverse_local(question: str, progress_callback=None) -> str:
         # Append confidence and citations to context (Claude will include in response)
         result += f"\n\n---\n**Retrieval Confidence:** {confidence['stars']} {confidence['level'].replace('_', ' ').title()} *{confidence['reasoning']}*\n**Sources:**\n{citations_text}"
         
-        print(f"✅ [CLAUDE DEBUG] Returning structured context ({len(result)} chars)")
+        logger.debug("✅ [CLAUDE DEBUG] Returning structured context (%d chars)", len(result))
+        
+        if use_cache:
+            _rag_semantic_cache.put(query_vector, (result, citations_data), scope=cache_scope)
         
         # Return tuple: (context_string, citations_data)
         return result, citations_data
         
     except Exception as e:
-        print(f"❌ [CLAUDE DEBUG] Pinecone query error: {str(e)}")
-        import traceback
-        print(f"❌ [CLAUDE DEBUG] Full traceback:\n{traceback.format_exc()}")
+        logger.exception("❌ [CLAUDE DEBUG] Pinecone query error: %s", e)
         return ""
 
-def search_web_brave(query: str) -> str:
-    """Search the web using Brave Search API for current information"""
-    import httpx
-    
-    if not BRAVE_API_KEY:
-        print("⚠️ BRAVE_API_KEY not set, web search unavailable")
-        return "Web search is not configured. Please add a Brave Search API key."
-    
-    try:
-        print(f"🌐 Searching web via Brave API: {query}")
-        
-        headers = {
+BRAVE_SEARCH_URL = 'https://api.search.brave.com/res/v1/web/search'
+
+# Shared client: keep-alive connections are reused across requests instead of
+# paying a TLS handshake per call. It is thread-safe and serves the tool executor
+# threads; closed by close_http_clients().
+_BRAVE_HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+_BRAVE_HTTP_TIMEOUT = httpx.Timeout(10.0, connect=2.0)
+# Transport-level retries only cover failed connects (e.g. a pooled connection
+# the server dropped), so they never repeat a request that reached Brave
+_BRAVE_CONNECT_RETRIES = 2
+
+# HTTP/2 lets concurrent searches share one connection. It needs the optional
+# h2 package (pip install "httpx[http2]"); without it the client uses HTTP/1.1.
+try:
+    import h2  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+def _new_http_client() -> httpx.Client:
+    transport = httpx.HTTPTransport(
+        limits=_BRAVE_HTTP_LIMITS, retries=_BRAVE_CONNECT_RETRIES, http2=_HTTP2_AVAILABLE
+    )
+    return httpx.Client(timeout=_BRAVE_HTTP_TIMEOUT, transport=transport)
+
+_http_client = _new_http_client()
+
+def _get_http_client() -> httpx.Client:
+    """Return the shared pooled Client (reopened if an app shutdown closed it)"""
+    global _http_client
+    if _http_client.is_closed:
+        _http_client = _new_http_client()
+    return _http_client
+
+def close_http_clients() -> None:
+    """Close pooled HTTP clients (call from the app shutdown hook)"""
+    _http_client.close()
+
+def _brave_request_args(query: str) -> dict:
+    """Headers and params for a Brave Search call (sent again on a 429 retry)"""
+    return {
+        'headers': {
             'X-Subscription-Token': BRAVE_API_KEY,
             'Accept': 'application/json'
-        }
-        
-        params = {
+        },
+        'params': {
             'q': query,
             'count': 5,
+            # Only web results are used: skip news/videos/discussions/etc. in the payload
+            'result_filter': 'web',
             'text_decorations': False,
             'search_lang': 'en'
         }
-        
-        response = httpx.get(
-            'https://api.search.brave.com/res/v1/web/search',
-            headers=headers,
-            params=params,
-            timeout=10.0
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            results = []
-            
-            # Extract web results
-            web_results = data.get('web', {}).get('results', [])
-            
-            for result in web_results[:5]:
-                title = result.get('title', '')
-                description = result.get('description', '')
-                url = result.get('url', '')
-                
-                if description:
-                    results.append(f"{title}\n{description}\nSource: {url}")
+    }
+
+# Longest Retry-After (seconds) worth waiting for inside a chat turn
+BRAVE_MAX_RETRY_AFTER = 2.0
+
+def _brave_retry_after(response) -> float | None:
+    """Seconds to wait before one retry of a rate-limited (429) Brave call, or None"""
+    if response.status_code != 429:
+        return None
+    try:
+        retry_after = float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+    return retry_after if 0 <= retry_after <= BRAVE_MAX_RETRY_AFTER else None
+
+def _format_brave_response(response, query: str) -> str:
+    """Turn a Brave Search HTTP response into the tool result text"""
+    if response.status_code == 200:
+        # json.loads takes the raw bytes directly, skipping httpx's text decode
+        data = json.loads(response.content)
+        results = []
+        
+        # Extract web results
+        web_results = data.get('web', {}).get('results', [])
+        
+        for result in web_results[:5]:
+            title = result.get('title', '')
+            description = result.get('description', '')
+            url = result.get('url', '')
             
-            if results:
-                print(f"✅ Brave Search found {len(results)} results")
-                return "\n\n---\n\n".join(results)
-            else:
-                return f"No web results found for '{query}'."
-        
-        elif response.status_code == 429:
-            return "Rate limit reached. Please try again in a moment."
-        
-        elif response.status_code == 401:
-            return "API key invalid. Please check your Brave Search API key."
+            if description:
+                results.append(f"{title}\n{description}\nSource: {url}")
         
+        if results:
+            logger.debug("✅ Brave Search found %d results", len(results))
+            return "\n\n---\n\n".join(results)
         else:
-            print(f"❌ Brave API error {response.status_code}: {response.text}")
-            return f"Web search temporarily unavailable (Error {response.status_code})."
+            return f"No web results found for '{query}'."
+    
+    elif response.status_code == 429:
+        return "Rate limit reached. Please try again in a moment."
+    
+    elif response.status_code == 401:
+        return "API key invalid. Please check your Brave Search API key."
+    
+    else:
+        logger.error("❌ Brave API error %s: %s", response.status_code, response.text)
+        return f"Web search temporarily unavailable (Error {response.status_code})."
+
+# Shared by every worker thread, so concurrent chats queue for the plan's rate
+# locally instead of tripping Brave's 429s. A search that would queue longer
+# than BRAVE_MAX_QUEUE_WAIT is answered as busy right away.
+BRAVE_MAX_QUEUE_WAIT = 5.0
+BRAVE_BUSY_MESSAGE = "Web search is busy right now. Please try again in a moment."
+
+def _read_brave_rate_limit() -> float:
+    """BRAVE_RATE_LIMIT as requests/second, falling back to 1 when unset or not positive"""
+    raw = os.getenv("BRAVE_RATE_LIMIT", "1")
+    try:
+        rate = float(raw)
+    except ValueError:
+        rate = 0.0
+    if rate > 0:
+        return rate
+    logger.warning("⚠️ Invalid BRAVE_RATE_LIMIT %r, using 1 request/second", raw)
+    return 1.0
+
+BRAVE_RATE_LIMIT = _read_brave_rate_limit()  # Requests/second allowed by the Brave plan
+_brave_rate_limiter = TokenBucket(rate=BRAVE_RATE_LIMIT)
+
+# Successful searches are reused for an hour: the same web query from another
+# chat (or a retried turn) costs no Brave quota and no round-trip
+_brave_result_cache = TTLCache(maxsize=256, ttl=3600.0)
+
+def _cache_brave_result(cache_key: str, response, query: str) -> str:
+    """Format a Brave response, caching it when the search succeeded"""
+    result = _format_brave_response(response, query)
+    if response.status_code == 200:
+        _brave_result_cache.put(cache_key, result)
+    return result
+
+def search_web_brave(query: str) -> str:
+    """Search the web using Brave Search API for current information"""
+    if not BRAVE_API_KEY:
+        logger.warning("⚠️ BRAVE_API_KEY not set, web search unavailable")
+        return "Web search is not configured. Please add a Brave Search API key."
+    
+    cache_key = question_key(query)
+    cached_result = _brave_result_cache.get(cache_key)
+    if cached_result is not None:
+        logger.debug("⚡ [WEB CACHE HIT] Reusing Brave results for: %s", query)
+        return cached_result
+    
+    if not _brave_rate_limiter.acquire(BRAVE_MAX_QUEUE_WAIT):
+        logger.warning("⚠️ Brave rate limit queue full, skipping web search: %s", query)
+        return BRAVE_BUSY_MESSAGE
+    
+    try:
+        logger.info("🌐 Searching web via Brave API: %s", query)
+        response = _get_http_client().get(BRAVE_SEARCH_URL, **_brave_request_args(query))
+        retry_after = _brave_retry_after(response)
+        if retry_after is not None:
+            # The retry is another Brave request, so it queues for its own slot
+            wait = _brave_rate_limiter.reserve(BRAVE_MAX_QUEUE_WAIT)
+            if wait is not None:
+                time.sleep(max(retry_after, wait))
+                response = _get_http_client().get(BRAVE_SEARCH_URL, **_brave_request_args(query))
+        return _cache_brave_result(cache_key, response, query)
     
     except Exception as e:
-        print(f"❌ Web search error: {str(e)}")
+        logger.error("❌ Web search error: %s", e)
         return "Unable to perform web search at this time."
 
+# Reference data is static and there are 16 types, so both tool result formats
+# are built once per type code and reused
+@lru_cache(maxsize=64)
+def format_reference_data_markdown(type_code: str) -> tuple[str, bool]:
+    """
+    Format reference data for a type as the Markdown tool result used by chat_with_claude.
+    Returns: (result_text, found)
+    """
+    # Lookup in reference data using same loader as type_injection
+    type_data = get_type_stack(type_code)
+    
+    if not type_data:
+        logger.warning("❌ [REFERENCE DATA] No data for %s", type_code)
+        return f"No reference data found for type: {type_code}", False
+    
+    # Extract four sides data properly
+    four_sides = type_data.get("four_sides", {})
+    
+    # Extract type codes from each side
+    ego_type = four_sides.get('ego', {}).get('type', 'Unknown')
+    shadow_type = four_sides.get('shadow', {}).get('type', 'Unknown')
+    subconscious_type = four_sides.get('subconscious', {}).get('type', 'Unknown')
+    superego_type = four_sides.get('superego', {}).get('type', 'Unknown')
+    
+    # Format functions for each side
+    def format_functions(funcs):
+        return '\n'.join([f"  • {f.get('position', 'Unknown')}: {f.get('function', 'Unknown')}" for f in funcs])
+    
+    # Build formatted response
+    result_text = f"""**{type_code} Complete Type Information:**
+
+🎭 **Ego ({ego_type}):**
+{format_functions(four_sides.get('ego', {}).get('functions', []))}
+
+👥 **Shadow ({shadow_type}):**
+{format_functions(four_sides.get('shadow', {}).get('functions', []))}
+
+🔄 **Subconscious ({subconscious_type}):**
+{format_functions(four_sides.get('subconscious', {}).get('functions', []))}
+
+⚡ **Superego ({superego_type}):**
+{format_functions(four_sides.get('superego', {}).get('functions', []))}
+
+**Categories:**
+• Temperament: {type_data.get('categories', {}).get('temperament', 'Unknown')}
+• Quadra: {type_data.get('categories', {}).get('quadra', 'Unknown')}
+• Interaction Style: {type_data.get('categories', {}).get('interaction_style', 'Unknown')}
+• Temple: {type_data.get('categories', {}).get('temple', 'Unknown')}"""
+    
+    logger.debug("✅ [REFERENCE DATA] Found and formatted data for %s", type_code)
+    return result_text, True
+
+@lru_cache(maxsize=64)
+def reference_data_json(type_code: str) -> str:
+    """Reference data for a type as the raw JSON tool result used by the streaming path"""
+    type_data = get_type_stack(type_code)
+    
+    if type_data:
+        logger.debug("✅ [REFERENCE DATA STREAMING] Found data for %s", type_code)
+        # Compact: indentation only adds prompt tokens to the tool result
+        return json.dumps(type_data, separators=(",", ":"), ensure_ascii=False)
+    
+    logger.warning("❌ [REFERENCE DATA STREAMING] No data for %s", type_code)
+    return f"No reference data found for type: {type_code}"
+
+def _reference_tool_result(type_code: str) -> tuple[str, dict]:
+    result_text, found = format_reference_data_markdown(type_code)
+    return result_text, {"found": found}
+
+def _text_tool_result(tool_fn, argument: str) -> tuple[str, dict]:
+    result_text = tool_fn(argument)
+    return result_text, {"result_length": len(result_text)}
+
+def _start_reference_data_tool(tool_input: dict):
+    type_code = tool_input.get("type_code", "").upper()
+    logger.debug("📖 [REFERENCE DATA] Looking up type: %s", type_code)
+    detail = {"tool": "query_reference_data", "type_code": type_code}
+    return detail, _TOOL_EXECUTOR.submit(_reference_tool_result, type_code)
+
+def _start_innerverse_backend_tool(tool_input: dict):
+    question = tool_input.get("question", "")
+    logger.debug("🔍 Querying InnerVerse Pinecone (local) for: %s", question)
+    detail = {"tool": "query_innerverse_backend", "question": question}
+    return detail, _TOOL_EXECUTOR.submit(_text_tool_result, query_innerverse_context, question)
+
+def _start_search_web_tool(tool_input: dict):
+    query = tool_input.get("query", "")
+    logger.debug("🌐 Searching web for: %s", query)
+    detail = {"tool": "search_web", "query": query}
+    return detail, _TOOL_EXECUTOR.submit(_text_tool_result, search_web_brave, query)
+
+# Tool name -> handler for chat_with_claude. Each handler starts its tool on the
+# executor and returns (detail, future); the future resolves to
+# (result_text, detail_fields). Tools missing here are skipped.
+CHAT_TOOL_HANDLERS = {
+    "query_reference_data": _start_reference_data_tool,
+    "query_innerverse_backend": _start_innerverse_backend_tool,
+    "search_web": _start_search_web_tool,
+}
+
+def _stream_reference_data_tool(tool_input: dict):
+    type_code = tool_input.get("type_code", "").upper()
+    return _TOOL_EXECUTOR.submit(reference_data_json, type_code)
+
+def _stream_search_web_tool(tool_input: dict):
+    query = tool_input.get("query", "")
+    return _TOOL_EXECUTOR.submit(search_web_brave, query)
+
+# Tool name -> handler for chat_with_claude_streaming. Each handler starts its
+# tool on the executor and returns the future; the status frame comes from
+# TOOL_STATUS_FRAMES. Register new streamed tools in both tables.
+STREAMING_TOOL_HANDLERS = {
+    "query_reference_data": _stream_reference_data_tool,
+    "search_web": _stream_search_web_tool,
+}
+
+def parse_tool_arguments(arguments: str) -> Optional[Dict]:
+    """Decode streamed tool-call arguments, or None while the JSON is still incomplete"""
+    try:
+        return json.loads(arguments)
+    except json.JSONDecodeError:
+        return None
+
+
+def start_streaming_tool(tool_name: str, tool_input: Optional[Dict]):
+    """
+    Start a streamed tool call on the tool executor.
+    Returns: (status_frame, future), or None for tools the streaming path doesn't offer
+    """
+    handler = STREAMING_TOOL_HANDLERS.get(tool_name)
+    if handler is None:
+        return None
+    
+    if tool_input is None:
+        tool_input = {}
+    
+    return TOOL_STATUS_FRAMES.get(tool_name, SSE_SEARCHING), handler(tool_input)
+
+def relay_prefetch_progress(question: str):
+    """
+    Run the RAG pre-fetch on its own executor and yield its progress stages
+    ("searching_pinecone", "ranking") as SSE status frames while it runs.
+    Use as ``result = yield from relay_prefetch_progress(question)``.
+    """
+    stages = queue.Queue()
+    future = _PREFETCH_EXECUTOR.submit(query_innerverse_local, question, stages.put)
+    future.add_done_callback(lambda _: stages.put(None))  # Wakes the loop below when done
+    last_stage = "searching"  # Already sent by the caller
+    
+    while True:
+        stage = stages.get()
+        if stage is None:
+            break
+        if stage != last_stage:
+            last_stage = stage
+            yield status_frame(stage)
+    
+    return future.result()
+
+def query_innerverse_context(question: str) -> str:
+    """
+    Run query_innerverse_local and return only the context string
+    (citations are only consumed by the streaming pre-fetch).
+    Never returns an empty string, so callers can use it as tool content directly.
+    """
+    result = query_innerverse_local(question)
+    # Handle tuple return (context, citations_data) or string (backwards compat)
+    if isinstance(result, tuple):
+        backend_result, _ = result
+    else:
+        backend_result = result
+    return backend_result or NO_RESULTS_MESSAGE
+
+# Conversation history sent per call. Routes pass the whole stored conversation,
+# so long chats are windowed to the most recent turns (~4 chars per token).
+MAX_HISTORY_MESSAGES = 40
+MAX_HISTORY_CHARS = 120_000
+
+def _message_chars(msg: Dict) -> int:
+    content = msg.get("content")
+    if isinstance(content, str):
+        return len(content)
+    if isinstance(content, list):
+        # Only text blocks count; image payloads are sized by the provider, not by tokens
+        return sum(len(block.get("text", "")) for block in content if isinstance(block, dict))
+    return 0
+
+def build_openai_messages(system_message: str, messages: List[Dict]) -> List[Dict]:
+    """
+    System message followed by the most recent conversation turns that fit in
+    MAX_HISTORY_MESSAGES / MAX_HISTORY_CHARS. The latest message is always kept,
+    and the window never starts on an assistant turn.
+    """
+    history = deque(
+        ({"role": msg.get("role"), "content": msg.get("content")} for msg in messages),
+        maxlen=MAX_HISTORY_MESSAGES
+    )
+    total_chars = sum(_message_chars(msg) for msg in history)
+    while len(history) > 1 and (total_chars > MAX_HISTORY_CHARS or history[0]["role"] == "assistant"):
+        total_chars -= _message_chars(history.popleft())
+    
+    return [{"role": "system", "content": system_message}, *history]
+
+def build_tool_turn_messages(tool_results: List[tuple]) -> List[Dict]:
+    """
+    OpenAI-format messages for one tool turn: a single assistant message carrying
+    every tool call, followed by one tool message per call.
+    tool_results: (call_id, tool_name, arguments_json, result_text) tuples
+    """
+    assistant_message = {
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [
+            {"id": call_id, "type": "function", "function": {"name": tool_name, "arguments": arguments}}
+            for call_id, tool_name, arguments, _ in tool_results
+        ]
+    }
+    return [assistant_message] + [
+        {"role": "tool", "tool_call_id": call_id, "content": result_text}
+        for call_id, _, _, result_text in tool_results
+    ]
+
 def has_image_content(messages):
     """
     Check if any message contains image content (for hybrid model routing).
@@ -735,19 +1423,63 @@ def get_model_for_request(messages):
     Returns: (model_name, input_price_per_m, output_price_per_m)
     """
     if has_image_content(messages):
-        print("🖼️ [ROUTER] Image detected → using glm-4.6v (vision model)")
+        logger.debug("🖼️ [ROUTER] Image detected → using glm-4.6v (vision model)")
         return ("glm-4.6v", 0.10, 0.10)  # Z.ai direct pricing
     else:
-        print("📝 [ROUTER] Text-only → using glm-4.7")
+        logger.debug("📝 [ROUTER] Text-only → using glm-4.7")
         return ("glm-4.7", 0.10, 0.10)  # Z.ai direct pricing
 
+# Request settings shared by both chat paths
+CHAT_MAX_TOKENS = 4096
+CHAT_TIMEOUT = 60.0
+
+def build_chat_request(model: str, openai_messages: List[Dict], tools: List[Dict], **overrides) -> Dict:
+    """Keyword arguments for client.chat.completions.create (streaming passes stream=True)"""
+    return {
+        "model": model,
+        "max_tokens": CHAT_MAX_TOKENS,
+        "messages": openai_messages,
+        "tools": tools,
+        "timeout": CHAT_TIMEOUT,
+        **overrides,
+    }
+
+def last_user_text(messages: List[Dict]) -> Optional[str]:
+    """Text of the latest user message (first text block when content is a list)"""
+    for msg in reversed(messages):
+        if msg.get('role') == 'user':
+            content = msg.get('content')
+            if isinstance(content, list):
+                for block in content:
+                    if isinstance(block, dict) and block.get('type') == 'text':
+                        return block.get('text', '')
+            return content
+    return None
+
+# Longest single wait between chat retries (also caps a server Retry-After)
+CHAT_RETRY_MAX_DELAY = 30.0
+# Shown to the user when retries run out; callers match on "temporarily busy"
+CHAT_BUSY_MESSAGE = "The chat service is temporarily busy. Please try again in a moment."
+
+def _retry_after_seconds(error: Exception) -> float:
+    """Retry-After from an API error response in seconds, or 0 when absent/unparseable"""
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers.get('retry-after', 0)) if response is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
 def make_openrouter_api_call_with_retry(client, **kwargs):
     """
-    Make OpenRouter API call with exponential backoff retry logic for errors.
-    Retries: 2s wait, then 4s wait. Max 3 attempts total.
+    Make chat API call with jittered exponential backoff on transient errors
+    (rate limits, overload, timeouts, dropped connections). Waits ~2s then ~4s,
+    each stretched by up to 50% so clients that failed together don't retry in
+    lockstep, or longer if the backend sends Retry-After. Max 3 attempts total.
+    Other 4xx errors are raised immediately.
     """
     max_retries = 2
-    retry_delays = [2, 4]  # Exponential backoff: 2s, then 4s
+    # This loop owns the retry policy; the SDK's own retries would multiply it
+    client = client.with_options(max_retries=0)
     
     for attempt in range(max_retries + 1):
         try:
@@ -756,22 +1488,132 @@ def make_openrouter_api_call_with_retry(client, **kwargs):
         
         except Exception as e:
             error_message = str(e).lower()
-            is_retriable = 'overloaded' in error_message or 'rate' in error_message or '503' in error_message or '529' in error_message
+            is_retriable = isinstance(e, _RETRIABLE_OPENAI_ERRORS) or (
+                not isinstance(e, openai.APIStatusError)
+                and ('overloaded' in error_message or '503' in error_message or '529' in error_message)
+            )
             
             if is_retriable and attempt < max_retries:
-                wait_time = retry_delays[attempt]
-                print(f"⚠️ Together API error (attempt {attempt + 1}/{max_retries + 1}). Retrying in {wait_time}s...")
+                backoff = 2.0 * 2 ** attempt * (1 + random.random() * 0.5)
+                wait_time = min(CHAT_RETRY_MAX_DELAY, max(backoff, _retry_after_seconds(e)))
+                logger.warning("⚠️ Chat API error (attempt %d/%d): %s. Retrying in %.1fs...",
+                               attempt + 1, max_retries + 1, e, wait_time)
                 time.sleep(wait_time)
                 continue
             
             # If not retriable or max retries reached, re-raise
             if is_retriable:
-                raise Exception("Together API is temporarily busy. Please try again in a moment.")
+                raise Exception(CHAT_BUSY_MESSAGE)
             else:
                 raise
     
     # This shouldn't be reached, but just in case
-    raise Exception("Together API is temporarily busy. Please try again in a moment.")
+    raise Exception(CHAT_BUSY_MESSAGE)
+
+@lru_cache(maxsize=4)
+def get_chat_client(api_key: str) -> OpenAI:
+    """
+    Shared chat client per API key, so its HTTP keep-alive pool is reused across
+    requests. Callers still read the key at runtime; a rotated key gets a new client.
+    """
+    return OpenAI(
+        api_key=api_key,
+        base_url="https://api.z.ai/api/paas/v4/"
+    )
+
+# ===== TOOL SCHEMAS (OpenAI function calling format) =====
+# Built once at import and passed by reference on every call. Pieces that are
+# identical in both tool sets are defined once and shared.
+_TYPE_CODE_PARAMETERS = {
+    "type": "object",
+    "properties": {
+        "type_code": {
+            "type": "string",
+            "description": "The MBTI type code in uppercase (e.g., INFJ, ENFP, ISTJ, ENTP)"
+        }
+    },
+    "required": ["type_code"]
+}
+
+_SEARCH_WEB_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "search_web",
+        "description": "Search the web for current information, facts, news, or general knowledge not in the MBTI knowledge base. Use this for restaurants, locations, current events, general facts, etc.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "The search query for public information"
+                }
+            },
+            "required": ["query"]
+        }
+    }
+}
+
+# chat_with_claude: reference lookup, knowledge base search, web search
+CHAT_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "query_reference_data",
+            "description": "Get exact MBTI type structures like four sides mappings, cognitive function stacks, temperaments, and quadra assignments. Use this FIRST for factual lookup questions about type structures (e.g., 'What are INFJ's four sides?', 'ENFP function stack', 'INTJ temperament'). Returns verified reference data.",
+            "parameters": _TYPE_CODE_PARAMETERS
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "query_innerverse_backend",
+            "description": "Search the InnerVerse knowledge base containing 183+ CS Joseph YouTube transcripts on MBTI, Jungian psychology, cognitive functions, and type theory. Use this when the user asks MBTI/psychology questions that need examples, context, or detailed explanations beyond basic type structures.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "question": {
+                        "type": "string",
+                        "description": "The question to search for in the MBTI knowledge base."
+                    }
+                },
+                "required": ["question"]
+            }
+        }
+    },
+    _SEARCH_WEB_TOOL
+]
+
+# chat_with_claude_streaming: RAG context is pre-fetched, so tools are kept as
+# FALLBACK only (web search, explicit reference lookups)
+_STREAMING_REFERENCE_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "query_reference_data",
+        "description": "Get exact MBTI type structures like four sides mappings, cognitive function stacks, temperaments, and quadra assignments. Use this ONLY if you need to verify specific type data not already provided in context.",
+        "parameters": _TYPE_CODE_PARAMETERS
+    }
+}
+
+STREAMING_TOOLS = [_STREAMING_REFERENCE_TOOL, _SEARCH_WEB_TOOL]
+
+# When the pre-fetched knowledge base context is a strong match, web search is
+# left out so the model answers from it instead of spending a Brave + model
+# round-trip on an in-domain question
+GROUNDED_STREAMING_TOOLS = [_STREAMING_REFERENCE_TOOL]
+GROUNDED_CONFIDENCE_LEVELS = frozenset({"high", "very_high"})
+
+def inject_rag_context(system_message: str, rag_context: str) -> str:
+    """Append pre-fetched knowledge base excerpts after the system prompt (keeps its prefix stable)"""
+    if not rag_context:
+        return system_message
+    logger.debug("✅ [INJECTION] Added %d chars of RAG context to system prompt", len(rag_context))
+    return system_message + f"""
+
+KNOWLEDGE BASE EXCERPTS
+Priority: For cognitive function stacks and four sides mappings, ALWAYS use the AUTHORITATIVE REFERENCE DATA above. Use these excerpts for context and examples only.
+
+{rag_context}
+"""
 
 def chat_with_claude(messages: List[Dict[str, str]], conversation_id: int) -> tuple[str, List[Dict]]:
     """
@@ -783,91 +1625,53 @@ def chat_with_claude(messages: List[Dict[str, str]], conversation_id: int) -> tu
     if not api_key:
         raise Exception("OPENROUTER_API_KEY not set")
     
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://api.z.ai/api/paas/v4/"
-    )
-    
-    # OpenAI function calling format
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "query_reference_data",
-                "description": "Get exact MBTI type structures like four sides mappings, cognitive function stacks, temperaments, and quadra assignments. Use this FIRST for factual lookup questions about type structures (e.g., 'What are INFJ's four sides?', 'ENFP function stack', 'INTJ temperament'). Returns verified reference data.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "type_code": {
-                            "type": "string",
-                            "description": "The MBTI type code in uppercase (e.g., INFJ, ENFP, ISTJ, ENTP)"
-                        }
-                    },
-                    "required": ["type_code"]
-                }
-            }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "query_innerverse_backend",
-                "description": "Search the InnerVerse knowledge base containing 183+ CS Joseph YouTube transcripts on MBTI, Jungian psychology, cognitive functions, and type theory. Use this when the user asks MBTI/psychology questions that need examples, context, or detailed explanations beyond basic type structures.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "question": {
-                            "type": "string",
-                            "description": "The question to search for in the MBTI knowledge base."
-                        }
-                    },
-                    "required": ["question"]
-                }
-            }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "search_web",
-                "description": "Search the web for current information, facts, news, or general knowledge not in the MBTI knowledge base. Use this for restaurants, locations, current events, general facts, etc.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {
-                            "type": "string",
-                            "description": "The search query for public information"
-                        }
-                    },
-                    "required": ["query"]
-                }
-            }
-        }
-    ]
+    client = get_chat_client(api_key)
     
     # Build system prompt with all 3 layers using centralized prompt builder
     # This ensures reference data injection is structurally enforced
-    last_user_message_content = None
-    for msg in reversed(messages):
-        if msg.get('role') == 'user':
-            last_user_message_content = msg.get('content')
-            break
+    last_user_message_content = last_user_text(messages)
+    
+    # Prompt assembly runs on the I/O pool while the knowledge base is pre-fetched
+    prompt_future = _RAG_IO_EXECUTOR.submit(
+        build_system_prompt,
+        conversation_id=conversation_id,
+        user_message=last_user_message_content or ""
+    )
+    
+    # PRE-FETCH RAG CONTEXT (same as the streaming path) so the common case needs
+    # no query_innerverse_backend tool round-trip before the answer
+    rag_context, citations_data = "", None
+    if last_user_message_content:
+        try:
+            result = query_innerverse_local(last_user_message_content)
+            # Only excerpts count as a hit: a bare string is a "no content" or
+            # error message and must not switch off the knowledge base tool
+            if isinstance(result, tuple) and result[0]:
+                rag_context, citations_data = result
+        except Exception as e:
+            logger.warning("⚠️ [PRE-FETCH] RAG search failed: %s", e)
     
     try:
-        system_message, prompt_metadata = build_system_prompt(
-            conversation_id=conversation_id,
-            user_message=last_user_message_content or ""
-        )
+        system_message, prompt_metadata = prompt_future.result()
     except PromptAssemblyError as e:
         error_msg = f"Prompt assembly failed: {e}"
-        print(f"❌ [PROMPT BUILDER] {error_msg}")
-        return (error_msg, [])
+        logger.error("❌ [PROMPT BUILDER] %s", error_msg)
+        return (error_msg, [], None)
+    
+    system_message = inject_rag_context(system_message, rag_context)
+    
+    # With excerpts in the prompt, offer the streaming tool set (no knowledge base
+    # search tool); if the pre-fetch came back empty the model can still search
+    tools = CHAT_TOOLS
+    if rag_context:
+        confidence_level = ((citations_data or {}).get("confidence") or {}).get("level")
+        tools = GROUNDED_STREAMING_TOOLS if confidence_level in GROUNDED_CONFIDENCE_LEVELS else STREAMING_TOOLS
     
     tool_use_details = []
     max_iterations = 3
     
     # Convert messages to OpenAI format with system message
-    openai_messages = [{"role": "system", "content": system_message}]
-    for msg in messages:
-        openai_messages.append({"role": msg.get("role"), "content": msg.get("content")})
+    openai_messages = build_openai_messages(system_message, messages)
     
     # Hybrid router: Select model based on content type
     selected_model, input_price, output_price = get_model_for_request(openai_messages)
@@ -875,12 +1679,7 @@ def chat_with_claude(messages: List[Dict[str, str]], conversation_id: int) -> tu
     for iteration in range(max_iterations):
         try:
             response = make_openrouter_api_call_with_retry(
-                client,
-                model=selected_model,
-                max_tokens=4096,
-                messages=openai_messages,
-                tools=tools,
-                timeout=60.0
+                client, **build_chat_request(selected_model, openai_messages, tools)
             )
         except Exception as e:
             # Catch user-friendly error messages from retry logic
@@ -896,6 +1695,11 @@ def chat_with_claude(messages: List[Dict[str, str]], conversation_id: int) -> tu
         if hasattr(response, 'usage'):
             input_tokens = getattr(response.usage, 'prompt_tokens', 0)
             output_tokens = getattr(response.usage, 'completion_tokens', 0)
+            # Prompt-prefix cache hits reported by the backend (the static system
+            # template and tool schemas lead every request, so repeats should hit)
+            prompt_details = getattr(response.usage, 'prompt_tokens_details', None)
+            cached_tokens = getattr(prompt_details, 'cached_tokens', None) or 0
+            logger.debug("💾 [PROMPT CACHE] %d of %d prompt tokens served from cache", cached_tokens, input_tokens)
             # Dynamic pricing based on selected model
             cost = (input_tokens / 1000000 * input_price) + (output_tokens / 1000000 * output_price)
             
@@ -906,7 +1710,7 @@ def chat_with_claude(messages: List[Dict[str, str]], conversation_id: int) -> tu
                 model_short = selected_model.split("/")[-1] if "/" in selected_model else selected_model
                 log_api_usage("openrouter_chat", model_short, input_tokens, output_tokens, cost)
             except Exception as e:
-                print(f"⚠️ Could not log OpenRouter usage: {e}")
+                logger.warning("⚠️ Could not log OpenRouter usage: %s", e)
         
         choice = response.choices[0]
         finish_reason = choice.finish_reason
@@ -914,142 +1718,35 @@ def chat_with_claude(messages: List[Dict[str, str]], conversation_id: int) -> tu
         if finish_reason == "stop":
             # Normal completion
             full_text = choice.message.content or ""
-            follow_up_question = extract_follow_up_question(full_text)
             
-            # Remove the [FOLLOW-UP: ...] from the main text
-            main_text = full_text
-            if follow_up_question:
-                import re
-                follow_up_match = re.search(r'\[FOLLOW-UP:\s*(.+?)\]', full_text, re.IGNORECASE)
-                if follow_up_match:
-                    main_text = full_text[:follow_up_match.start()].strip()
+            # Remove the [FOLLOW-UP: ...] from the main text (one regex scan for both)
+            follow_up_match = _FOLLOW_UP_RE.search(full_text)
+            follow_up_question = follow_up_match.group(1).strip() if follow_up_match else None
+            main_text = full_text[:follow_up_match.start()].strip() if follow_up_match else full_text
             
             return (main_text, tool_use_details, follow_up_question)
         
         elif finish_reason == "tool_calls":
-            # Handle tool calls
+            # Handle tool calls - start every requested tool before waiting on any,
+            # so a turn asking for Pinecone + web costs max() instead of sum()
             tool_calls = choice.message.tool_calls or []
+            pending_calls = []
             for tool_call in tool_calls:
-                tool_name = tool_call.function.name
-                tool_input = json.loads(tool_call.function.arguments)
-                    
-                if tool_name == "query_reference_data":
-                    type_code = tool_input.get("type_code", "").upper()
-                    print(f"📖 [REFERENCE DATA] Looking up type: {type_code}")
-                    
-                    # Lookup in reference data using same loader as type_injection
-                    type_data = get_type_stack(type_code)
-                    
-                    if type_data:
-                        # Extract four sides data properly
-                        four_sides = type_data.get("four_sides", {})
-                        
-                        # Extract type codes from each side
-                        ego_type = four_sides.get('ego', {}).get('type', 'Unknown')
-                        shadow_type = four_sides.get('shadow', {}).get('type', 'Unknown')
-                        subconscious_type = four_sides.get('subconscious', {}).get('type', 'Unknown')
-                        superego_type = four_sides.get('superego', {}).get('type', 'Unknown')
-                        
-                        # Format functions for each side
-                        def format_functions(funcs):
-                            return '\n'.join([f"  • {f.get('position', 'Unknown')}: {f.get('function', 'Unknown')}" for f in funcs])
-                        
-                        # Build formatted response
-                        result_text = f"""**{type_code} Complete Type Information:**
-
-🎭 **Ego ({ego_type}):**
-{format_functions(four_sides.get('ego', {}).get('functions', []))}
-
-👥 **Shadow ({shadow_type}):**
-{format_functions(four_sides.get('shadow', {}).get('functions', []))}
-
-🔄 **Subconscious ({subconscious_type}):**
-{format_functions(four_sides.get('subconscious', {}).get('functions', []))}
-
-⚡ **Superego ({superego_type}):**
-{format_functions(four_sides.get('superego', {}).get('functions', []))}
-
-**Categories:**
-• Temperament: {type_data.get('categories', {}).get('temperament', 'Unknown')}
-• Quadra: {type_data.get('categories', {}).get('quadra', 'Unknown')}
-• Interaction Style: {type_data.get('categories', {}).get('interaction_style', 'Unknown')}
-• Temple: {type_data.get('categories', {}).get('temple', 'Unknown')}"""
-                        
-                        print(f"✅ [REFERENCE DATA] Found and formatted data for {type_code}")
-                    else:
-                        result_text = f"No reference data found for type: {type_code}"
-                        print(f"❌ [REFERENCE DATA] No data for {type_code}")
-                    
-                    tool_use_details.append({
-                        "tool": "query_reference_data",
-                        "type_code": type_code,
-                        "found": bool(type_data)
-                    })
-                    
-                    # OpenAI format: add assistant message with tool_calls, then tool result
-                    openai_messages.append({
-                        "role": "assistant",
-                        "content": None,
-                        "tool_calls": [{"id": tool_call.id, "type": "function", "function": {"name": tool_name, "arguments": tool_call.function.arguments}}]
-                    })
-                    openai_messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "content": result_text
-                    })
-                
-                elif tool_name == "query_innerverse_backend":
-                    question = tool_input.get("question", "")
-                    print(f"🔍 Querying InnerVerse Pinecone (local) for: {question}")
-                    
-                    result = query_innerverse_local(question)
-                    # Handle tuple return (context, citations_data) or string (backwards compat)
-                    if isinstance(result, tuple):
-                        backend_result, _ = result  # Citations not used in non-streaming mode
-                    else:
-                        backend_result = result
-                    
-                    tool_use_details.append({
-                        "tool": "query_innerverse_backend",
-                        "question": question,
-                        "result_length": len(backend_result)
-                    })
-                    
-                    # OpenAI format: add assistant message with tool_calls, then tool result
-                    openai_messages.append({
-                        "role": "assistant",
-                        "content": None,
-                        "tool_calls": [{"id": tool_call.id, "type": "function", "function": {"name": tool_name, "arguments": tool_call.function.arguments}}]
-                    })
-                    openai_messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "content": backend_result if backend_result else "No relevant content found in knowledge base."
-                    })
-                
-                elif tool_name == "search_web":
-                    query = tool_input.get("query", "")
-                    print(f"🌐 Searching web for: {query}")
-                    
-                    web_result = search_web_brave(query)
-                    
-                    tool_use_details.append({
-                        "tool": "search_web",
-                        "query": query,
-                        "result_length": len(web_result)
-                    })
-                    
-                    # OpenAI format: add assistant message with tool_calls, then tool result
-                    openai_messages.append({
-                        "role": "assistant",
-                        "content": None,
-                        "tool_calls": [{"id": tool_call.id, "type": "function", "function": {"name": tool_name, "arguments": tool_call.function.arguments}}]
-                    })
-                    openai_messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "content": web_result
-                    })
+                handler = CHAT_TOOL_HANDLERS.get(tool_call.function.name)
+                if handler is None:
+                    continue
+                detail, future = handler(json.loads(tool_call.function.arguments))
+                pending_calls.append((tool_call, detail, future))
+            
+            tool_results = []
+            for tool_call, detail, future in pending_calls:
+                result_text, result_detail = future.result()
+                detail.update(result_detail)
+                tool_use_details.append(detail)
+                tool_results.append((tool_call.id, tool_call.function.name, tool_call.function.arguments, result_text))
+            
+            if tool_results:
+                openai_messages.extend(build_tool_turn_messages(tool_results))
             continue
         
         else:
@@ -1073,52 +1770,41 @@ def chat_with_claude_streaming(messages: List[Dict[str, str]], conversation_id:
     - Use async RAG search to prevent blocking
     - Send heartbeat events to keep connection alive and show progress
     """
-    # json is imported at module level (line 9)
-    import time
     start_time = time.time()
     
     # Get API key at runtime (not cached at import) to pick up newly added secrets
     api_key = os.getenv("OPENROUTER_API_KEY")
     if not api_key:
-        yield "data: " + '{"error": "OPENROUTER_API_KEY not set"}\n\n'
+        yield SSE_MISSING_API_KEY
         return
     
-    # Debug: Check API key
-    key_prefix = api_key[:10] if len(api_key) > 10 else api_key[:4]
-    print(f"🔑 [DEBUG] Z.ai API key prefix: {key_prefix}...")
-    
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://api.z.ai/api/paas/v4/"
-    )
+    client = get_chat_client(api_key)
     full_response_text = []  # Accumulate response for follow-up extraction
     citations_data = None  # Store citations from RAG query
     
     # Extract last user message for RAG pre-fetch
-    last_user_message_content = None
-    for msg in reversed(messages):
-        if msg.get('role') == 'user':
-            last_user_message_content = msg.get('content')
-            # Handle content that might be a list
-            if isinstance(last_user_message_content, list):
-                for block in last_user_message_content:
-                    if isinstance(block, dict) and block.get('type') == 'text':
-                        last_user_message_content = block.get('text', '')
-                        break
-            break
+    last_user_message_content = last_user_text(messages)
     
     # Send initial status immediately - this MUST be yielded first to establish SSE connection
-    yield "data: " + '{"status": "searching"}\n\n'
+    yield SSE_SEARCHING
+    
+    # Prompt assembly (reference injection + conversation memory) doesn't depend
+    # on the RAG result, so it runs on the I/O pool while the pre-fetch is in flight
+    prompt_future = _RAG_IO_EXECUTOR.submit(
+        build_system_prompt,
+        conversation_id=conversation_id,
+        user_message=last_user_message_content or ""
+    )
     
     # PRE-FETCH RAG CONTEXT: Do RAG search BEFORE Claude call
     # This eliminates the tool use round-trip (saves ~10-15s)
     rag_context = ""
     if last_user_message_content:
-        print(f"⚡ [PRE-FETCH] Starting RAG search BEFORE Claude call...")
+        logger.debug("⚡ [PRE-FETCH] Starting RAG search BEFORE Claude call...")
         rag_start = time.time()
         
         try:
-            result = query_innerverse_local(last_user_message_content)
+            result = yield from relay_prefetch_progress(last_user_message_content)
             
             # Handle tuple return (context, citations_data) or string
             if isinstance(result, tuple):
@@ -1128,204 +1814,168 @@ def chat_with_claude_streaming(messages: List[Dict[str, str]], conversation_id:
                 citations_data = None
             
             rag_time = time.time() - rag_start
-            print(f"✅ [PRE-FETCH] RAG search completed in {rag_time:.1f}s ({len(rag_context)} chars)")
+            logger.debug("✅ [PRE-FETCH] RAG search completed in %.1fs (%d chars)", rag_time, len(rag_context))
         except Exception as e:
-            print(f"⚠️ [PRE-FETCH] RAG search failed: {e}")
+            logger.warning("⚠️ [PRE-FETCH] RAG search failed: %s", e)
             rag_context = ""
     
     # Send status update after RAG completes
-    yield "data: " + '{"status": "generating"}\n\n'
-    
-    # Tools kept as FALLBACK only (web search, explicit reference lookups) - OpenAI function format
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "query_reference_data",
-                "description": "Get exact MBTI type structures like four sides mappings, cognitive function stacks, temperaments, and quadra assignments. Use this ONLY if you need to verify specific type data not already provided in context.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "type_code": {
-                            "type": "string",
-                            "description": "The MBTI type code in uppercase (e.g., INFJ, ENFP, ISTJ, ENTP)"
-                        }
-                    },
-                    "required": ["type_code"]
-                }
-            }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "search_web",
-                "description": "Search the web for current information, facts, news, or general knowledge not in the MBTI knowledge base. Use this for restaurants, locations, current events, general facts, etc.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {
-                            "type": "string",
-                            "description": "The search query for public information"
-                        }
-                    },
-                    "required": ["query"]
-                }
-            }
-        }
-    ]
+    yield SSE_GENERATING
     
-    # Build system prompt with all 3 layers using centralized prompt builder
+    # System prompt with all 3 layers from the centralized prompt builder
     try:
-        system_message, prompt_metadata = build_system_prompt(
-            conversation_id=conversation_id,
-            user_message=last_user_message_content or ""
-        )
+        system_message, prompt_metadata = prompt_future.result()
     except PromptAssemblyError as e:
         error_msg = f"Prompt assembly failed: {e}"
-        print(f"❌ [PROMPT BUILDER] {error_msg}")
-        yield "data: " + json.dumps({"error": error_msg}) + "\n\n"
+        logger.error("❌ [PROMPT BUILDER] %s", error_msg)
+        yield sse({"error": error_msg})
         return
     
     # INJECT PRE-FETCHED RAG CONTEXT into system prompt
-    if rag_context:
-        rag_injection = f"""
-
-KNOWLEDGE BASE EXCERPTS
-Priority: For cognitive function stacks and four sides mappings, ALWAYS use the AUTHORITATIVE REFERENCE DATA above. Use these excerpts for context and examples only.
-
-{rag_context}
-"""
-        system_message = system_message + rag_injection
-        print(f"✅ [INJECTION] Added {len(rag_context)} chars of RAG context to system prompt")
+    system_message = inject_rag_context(system_message, rag_context)
     
     max_iterations = 3
     
     # Convert messages to OpenAI format with system message
-    openai_messages = [{"role": "system", "content": system_message}]
-    for msg in messages:
-        openai_messages.append({"role": msg.get("role"), "content": msg.get("content")})
+    openai_messages = build_openai_messages(system_message, messages)
     
     # Hybrid router: Select model based on content type
     selected_model, input_price, output_price = get_model_for_request(openai_messages)
     
+    tools = STREAMING_TOOLS
+    confidence_level = ((citations_data or {}).get("confidence") or {}).get("level")
+    if confidence_level in GROUNDED_CONFIDENCE_LEVELS:
+        tools = GROUNDED_STREAMING_TOOLS
+        logger.debug("🎯 [PRE-FETCH] %s retrieval confidence - answering without web search", confidence_level)
+    
+    text_frames = DeltaCoalescer()
+    
     try:
         for iteration in range(max_iterations):
             # Send search status to frontend (only for tool use iterations)
             if iteration > 0:
-                yield "data: " + '{"status": "searching"}\n\n'
-            
-            # OpenAI streaming format
-            stream = client.chat.completions.create(
-                model=selected_model,
-                max_tokens=4096,
-                messages=openai_messages,
-                tools=tools,
-                stream=True,
-                timeout=60.0
-            )
+                yield SSE_SEARCHING
             
             collected_tool_calls = []
-            current_tool_call = None
+            started_tools = {}  # tool call index -> (status_frame, future) or None
+            requested_tools = False  # Only a tool turn re-enters the loop
             
-            for chunk in stream:
-                if not chunk.choices:
-                    continue
+            # OpenAI streaming format. The context manager closes the HTTP stream
+            # as soon as we leave it, including when the client disconnects and
+            # this generator is closed mid-response.
+            with client.chat.completions.create(
+                **build_chat_request(selected_model, openai_messages, tools, stream=True)
+            ) as stream:
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
                     
-                delta = chunk.choices[0].delta
-                finish_reason = chunk.choices[0].finish_reason
-                
-                # Handle text content streaming
-                if delta.content:
-                    text_chunk = delta.content
-                    full_response_text.append(text_chunk)
-                    yield "data: " + json.dumps({"chunk": text_chunk}) + "\n\n"
+                    delta = chunk.choices[0].delta
+                    finish_reason = chunk.choices[0].finish_reason
                 
-                # Handle tool calls (accumulate them)
-                if delta.tool_calls:
-                    for tool_call_delta in delta.tool_calls:
-                        if tool_call_delta.index is not None:
-                            # New tool call or continuing existing one
-                            while len(collected_tool_calls) <= tool_call_delta.index:
-                                collected_tool_calls.append({"id": "", "function": {"name": "", "arguments": ""}})
-                            
-                            tc = collected_tool_calls[tool_call_delta.index]
-                            if tool_call_delta.id:
-                                tc["id"] = tool_call_delta.id
-                            if tool_call_delta.function:
-                                if tool_call_delta.function.name:
-                                    tc["function"]["name"] = tool_call_delta.function.name
-                                if tool_call_delta.function.arguments:
-                                    tc["function"]["arguments"] += tool_call_delta.function.arguments
+                    # Handle text content streaming
+                    if delta.content:
+                        text_chunk = delta.content
+                        full_response_text.append(text_chunk)
+                        frame = text_frames.add(text_chunk)
+                        if frame:
+                            yield frame
+                    else:
+                        # Tool-call fragments also release text held past the time bound
+                        frame = text_frames.poll()
+                        if frame:
+                            yield frame
                 
-                # Handle finish
-                if finish_reason == "tool_calls":
-                    # Process tool calls
-                    for tc in collected_tool_calls:
-                        tool_name = tc["function"]["name"]
-                        try:
-                            tool_input = json.loads(tc["function"]["arguments"])
-                        except json.JSONDecodeError:
-                            tool_input = {}
-                        
-                        if tool_name == "query_reference_data":
-                            type_code = tool_input.get("type_code", "").upper()
-                            yield "data: " + '{"status": "looking_up_reference"}\n\n'
-                            type_data = get_type_stack(type_code)
+                    # Handle tool calls (accumulate them)
+                    if delta.tool_calls:
+                        for tool_call_delta in delta.tool_calls:
+                            if tool_call_delta.index is not None:
+                                # New tool call or continuing existing one
+                                while len(collected_tool_calls) <= tool_call_delta.index:
+                                    collected_tool_calls.append({"id": "", "function": {"name": "", "arguments": ""}})
                             
-                            if type_data:
-                                result_text = json.dumps(type_data, indent=2)
-                                print(f"✅ [REFERENCE DATA STREAMING] Found data for {type_code}")
-                            else:
-                                result_text = f"No reference data found for type: {type_code}"
-                                print(f"❌ [REFERENCE DATA STREAMING] No data for {type_code}")
+                                tc = collected_tool_calls[tool_call_delta.index]
+                                if tool_call_delta.id:
+                                    tc["id"] = tool_call_delta.id
+                                if tool_call_delta.function:
+                                    if tool_call_delta.function.name:
+                                        tc["function"]["name"] = tool_call_delta.function.name
+                                    if tool_call_delta.function.arguments:
+                                        tc["function"]["arguments"] += tool_call_delta.function.arguments
                             
-                            # OpenAI format: add assistant message with tool_calls, then tool result
-                            openai_messages.append({
-                                "role": "assistant",
-                                "content": None,
-                                "tool_calls": [{"id": tc["id"], "type": "function", "function": {"name": tool_name, "arguments": tc["function"]["arguments"]}}]
-                            })
-                            openai_messages.append({
-                                "role": "tool",
-                                "tool_call_id": tc["id"],
-                                "content": result_text
-                            })
+                                # Arguments are a JSON object, so once they parse the call is
+                                # complete - start the tool now instead of waiting for the
+                                # stream to close
+                                arguments = tc["function"]["arguments"]
+                                if tool_call_delta.index not in started_tools and arguments.endswith("}"):
+                                    tool_input = parse_tool_arguments(arguments)
+                                    if tool_input is None:
+                                        continue
+                                    started = start_streaming_tool(tc["function"]["name"], tool_input)
+                                    started_tools[tool_call_delta.index] = started
+                                    if started:
+                                        frame = text_frames.flush()
+                                        if frame:
+                                            yield frame
+                                        yield started[0]
+                
+                    # Handle finish (text still buffered goes out before any other frame)
+                    if finish_reason:
+                        frame = text_frames.flush()
+                        if frame:
+                            yield frame
+                    
+                    if finish_reason == "tool_calls":
+                        # Start any tool whose arguments only completed with the stream,
+                        # then wait on all of them (they run concurrently)
+                        pending_calls = []
+                        for index, tc in enumerate(collected_tool_calls):
+                            if index not in started_tools:
+                                started_tools[index] = start_streaming_tool(
+                                    tc["function"]["name"], parse_tool_arguments(tc["function"]["arguments"])
+                                )
+                                if started_tools[index]:
+                                    yield started_tools[index][0]
                         
-                        elif tool_name == "search_web":
-                            query = tool_input.get("query", "")
-                            yield "data: " + '{"status": "searching_web"}\n\n'
-                            web_result = search_web_brave(query)
-                            
-                            # OpenAI format: add assistant message with tool_calls, then tool result
-                            openai_messages.append({
-                                "role": "assistant",
-                                "content": None,
-                                "tool_calls": [{"id": tc["id"], "type": "function", "function": {"name": tool_name, "arguments": tc["function"]["arguments"]}}]
-                            })
-                            openai_messages.append({
-                                "role": "tool",
-                                "tool_call_id": tc["id"],
-                                "content": web_result
-                            })
+                            if started_tools[index]:
+                                pending_calls.append((tc, tc["function"]["name"], started_tools[index][1]))
                     
-                    # Continue to next iteration
-                    break
+                        tool_results = [
+                            (tc["id"], tool_name, tc["function"]["arguments"], future.result())
+                            for tc, tool_name, future in pending_calls
+                        ]
+                        if tool_results:
+                            openai_messages.extend(build_tool_turn_messages(tool_results))
+                    
+                        # Continue to next iteration
+                        requested_tools = True
+                        break
                 
-                elif finish_reason == "stop":
-                    # Done! Extract follow-up and send done payload
-                    follow_up = extract_follow_up_question("".join(full_response_text))
-                    done_payload = {"done": True, "follow_up": follow_up}
-                    if citations_data:
-                        done_payload["citations"] = citations_data
+                    elif finish_reason:
+                        # Done ("stop", or cut short by "length"/"content_filter") - a
+                        # new iteration would only regenerate the same answer.
+                        # Extract follow-up and send done payload
+                        follow_up = extract_follow_up_question("".join(full_response_text))
+                        done_payload = {"done": True, "follow_up": follow_up}
+                        if citations_data:
+                            done_payload["citations"] = citations_data
                     
-                    # Log total time
-                    total_time = time.time() - start_time
-                    print(f"⏱️ [TOTAL TIME] Response completed in {total_time:.1f}s")
+                        # Log total time
+                        total_time = time.time() - start_time
+                        logger.info("⏱️ [TOTAL TIME] Response completed in %.1fs", total_time)
                     
-                    yield "data: " + json.dumps(done_payload) + "\n\n"
-                    return
+                        yield sse(done_payload)
+                        return
+            
+            if not requested_tools:
+                # Stream ended without a finish reason: re-sending the same
+                # messages would only restart the answer, so finish here
+                break
     
-        # Max iterations reached - send done with follow-up
+        # Max iterations reached (or stream cut short) - send done with follow-up
+        frame = text_frames.flush()
+        if frame:
+            yield frame
         follow_up = extract_follow_up_question("".join(full_response_text))
         done_payload = {"done": True, "follow_up": follow_up}
         if citations_data:
@@ -1333,12 +1983,15 @@ Priority: For cognitive function stacks and four sides mappings, ALWAYS use the
         
         # Log total time
         total_time = time.time() - start_time
-        print(f"⏱️ [TOTAL TIME] Response completed in {total_time:.1f}s (max iterations)")
+        logger.info("⏱️ [TOTAL TIME] Response completed in %.1fs (%s)", total_time, 'max iterations' if requested_tools else 'stream ended')
         
-        yield "data: " + json.dumps(done_payload) + "\n\n"
+        yield sse(done_payload)
     
     except Exception as e:
         error_msg = str(e)
         total_time = time.time() - start_time
-        print(f"❌ Together streaming error after {total_time:.1f}s: {error_msg}")
-        yield "data: " + json.dumps({"error": f"Sorry, I encountered an error: {error_msg}. Please try again."}) + "\n\n"
+        logger.exception("❌ Streaming error after %.1fs: %s", total_time, error_msg)
+        frame = text_frames.flush()
+        if frame:
+            yield frame
+        yield sse({"error": f"Sorry, I encountered an error: {error_msg}. Please try again."})
@@ -12,7 +12,9 @@ import shutil
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
+from functools import lru_cache
 from urllib.parse import quote
 from typing import Dict, Any
 from fastapi import FastAPI, UploadFile, File, Request, Response, Header, HTTPException, BackgroundTasks, Cookie, Depends
@@ -40,8 +42,28 @@ import re
 import requests
 from http.cookiejar import MozillaCookieJar
 import threading
+import time
 import asyncio
 import traceback
+import logging
+import sys
+
+from src.core.pooled_connection import IdleConnectionPool, PooledConnection
+
+# Chat and retrieval modules only create loggers; their records go to stdout
+# here, at LOG_LEVEL (unknown values fall back to INFO). Not
+# src.core.logging.setup_logging: its Settings require keys this app runs without.
+_LOG_LEVEL = (os.getenv("LOG_LEVEL") or "INFO").upper()
+_log_level = logging.getLevelName(_LOG_LEVEL)  # An int for known level names
+_log_handler = logging.StreamHandler(sys.stdout)
+_log_handler.setFormatter(logging.Formatter("%(message)s"))
+for _logger_name in ("claude_api", "src.services.rag_cache"):
+    _module_logger = logging.getLogger(_logger_name)
+    _module_logger.setLevel(_log_level if isinstance(_log_level, int) else logging.INFO)
+    _module_logger.addHandler(_log_handler)
+    _module_logger.propagate = False
+if not isinstance(_log_level, int):
+    logging.getLogger("claude_api").warning("⚠️ Unknown LOG_LEVEL %r, using INFO", _LOG_LEVEL)
 
 # Knowledge Graph imports
 from src.services.concept_extractor import extract_concepts
@@ -144,12 +166,31 @@ PRICING = {
 }
 
 # === Database Functions ===
+# Idle connections kept for reuse, the age after which one is reconnected, and
+# how long one may sit idle (Neon drops connections when compute suspends)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+DB_POOL_IDLE_TIMEOUT = int(os.getenv("DB_POOL_IDLE_TIMEOUT", "240"))
+
+_db_pool = IdleConnectionPool(
+    lambda: psycopg2.connect(DATABASE_URL, connection_factory=PooledConnection),
+    max_idle=DB_POOL_SIZE,
+    max_age=DB_POOL_RECYCLE,
+    max_idle_time=DB_POOL_IDLE_TIMEOUT,
+)
+
+
 def get_db_connection():
-    """Get PostgreSQL database connection"""
+    """Get PostgreSQL database connection (reused from the idle pool when possible)"""
     if not DATABASE_URL:
         print("⚠️ DATABASE_URL not set - cost tracking will not work")
         return None
-    return psycopg2.connect(DATABASE_URL)
+    return _db_pool.get()
+
+
+def close_db_connections():
+    """Disconnect every idle pooled connection (for shutdown)"""
+    _db_pool.close_all()
 
 def get_db():
     """Alias for get_db_connection() - used by curriculum routes"""
@@ -454,13 +495,33 @@ def get_openai_client():
     return openai
 
 
+@lru_cache()
 def get_pinecone_client():
+    """Pinecone index handle (singleton, so its HTTP connections are reused across requests)"""
     if not PINECONE_API_KEY or not PINECONE_INDEX:
         return None
     pc = Pinecone(api_key=PINECONE_API_KEY)
     return pc.Index(PINECONE_INDEX)
 
 
+@lru_cache(maxsize=4)
+def get_anthropic_client(api_key: str) -> anthropic.Anthropic:
+    """Shared Anthropic client per API key, so its keep-alive pool is reused"""
+    return anthropic.Anthropic(api_key=api_key)
+
+
+@lru_cache(maxsize=4)
+def get_async_anthropic_client(api_key: str) -> anthropic.AsyncAnthropic:
+    """Shared async Anthropic client per API key, so its keep-alive pool is reused"""
+    return anthropic.AsyncAnthropic(api_key=api_key)
+
+
+# Shared pool for Pinecone queries that need a timeout. Created once: a pool
+# per request spawns threads every time, and leaving its `with` block waits
+# for a timed-out query to finish anyway.
+_PINECONE_QUERY_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="pinecone-query")
+
+
 # Split PDF text into chunks with improved parameters for CS Joseph transcripts
 def chunk_text(text, chunk_size=2500, chunk_overlap=500):
     """
@@ -1032,6 +1093,8 @@ async def lifespan(app: FastAPI):
     yield
     
     print("👋 Shutting down InnerVerse...")
+    close_http_clients()
+    close_db_connections()
 
 # Create FastAPI app with lifespan
 app = FastAPI(lifespan=lifespan)
@@ -1276,11 +1339,15 @@ OUTPUT FORMAT:
             batch_size = 50  # Safe batch size to stay under 4MB
             total_batches = (len(vectors_to_upsert) + batch_size - 1) // batch_size
             
-            for batch_num in range(0, len(vectors_to_upsert), batch_size):
-                batch = vectors_to_upsert[batch_num:batch_num + batch_size]
-                pinecone_index.upsert(vectors=batch)
-                current_batch = (batch_num // batch_size) + 1
-                print(f"📤 Uploaded batch {current_batch}/{total_batches} ({len(batch)} vectors)")
+            try:
+                for batch_num in range(0, len(vectors_to_upsert), batch_size):
+                    batch = vectors_to_upsert[batch_num:batch_num + batch_size]
+                    pinecone_index.upsert(vectors=batch)
+                    current_batch = (batch_num // batch_size) + 1
+                    print(f"📤 Uploaded batch {current_batch}/{total_batches} ({len(batch)} vectors)")
+            finally:
+                # Once per upload, also after a partial one
+                invalidate_rag_cache()
             
             print(f"✅ Successfully uploaded {len(vectors_to_upsert)} total chunks")
 
@@ -1496,15 +1563,19 @@ OUTPUT FORMAT:
             total_batches = (len(vectors_to_upsert) + batch_size - 1) // batch_size
             upsert_start = datetime.now()
             
-            for batch_num in range(0, len(vectors_to_upsert), batch_size):
-                batch = vectors_to_upsert[batch_num:batch_num + batch_size]
-                try:
-                    pinecone_index.upsert(vectors=batch)
-                    current_batch = (batch_num // batch_size) + 1
-                    print(f"📤 Uploaded batch {current_batch}/{total_batches} ({len(batch)} vectors)")
-                except Exception as upsert_error:
-                    print(f"❌ Pinecone upsert error on batch {current_batch}: {str(upsert_error)}")
-                    raise Exception(f"Failed to upload to Pinecone: {str(upsert_error)}")
+            try:
+                for batch_num in range(0, len(vectors_to_upsert), batch_size):
+                    batch = vectors_to_upsert[batch_num:batch_num + batch_size]
+                    try:
+                        pinecone_index.upsert(vectors=batch)
+                        current_batch = (batch_num // batch_size) + 1
+                        print(f"📤 Uploaded batch {current_batch}/{total_batches} ({len(batch)} vectors)")
+                    except Exception as upsert_error:
+                        print(f"❌ Pinecone upsert error on batch {current_batch}: {str(upsert_error)}")
+                        raise Exception(f"Failed to upload to Pinecone: {str(upsert_error)}")
+            finally:
+                # Once per upload, also after a partial one
+                invalidate_rag_cache()
             
             upsert_elapsed = (datetime.now() - upsert_start).total_seconds()
             total_elapsed = (datetime.now() - embed_start).total_seconds()
@@ -1649,6 +1720,7 @@ async def delete_all_documents():
         
         # Delete all vectors (delete_all is faster than filtering)
         pinecone_index.delete(delete_all=True)
+        invalidate_rag_cache()
         
         print(f"✅ Deleted ALL vectors from Pinecone index")
         
@@ -1675,6 +1747,7 @@ async def delete_document(document_id: str):
         
         # Delete all vectors with this doc_id using metadata filter
         pinecone_index.delete(filter={"doc_id": document_id})
+        invalidate_rag_cache()
         
         print(f"✅ Deleted all vectors for document: {document_id}")
         
@@ -1766,6 +1839,7 @@ async def rename_document(document_id: str, request: RenameDocumentRequest):
             
             if upsert_data:
                 pinecone_index.upsert(vectors=upsert_data)
+                invalidate_rag_cache()
         
         print(f"✅ Renamed document {document_id} to '{request.new_filename}' ({len(updates)} vectors updated)")
         
@@ -2230,46 +2304,45 @@ async def query_pdf(request: QueryRequest, authorization: str = Header(None)):
             filter_conditions.append(analysis['pinecone_filter'])
         
         # Build final filter and query with timeout protection
-        from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+        from concurrent.futures import TimeoutError as FuturesTimeoutError
         
         # Use intelligent top_k (30-50 based on query complexity vs old 5)
         search_top_k = analysis['recommended_top_k']
         
         try:
-            with ThreadPoolExecutor() as executor:
-                if len(filter_conditions) == 0:
-                    # No filters - search all documents
-                    print(f"🔍 Searching across ALL documents (top_k={search_top_k})")
-                    future = executor.submit(
-                        pinecone_index.query,
-                        vector=question_vector,
-                        top_k=search_top_k,
-                        include_metadata=True
-                    )
-                    query_response = future.result(timeout=10.0)
-                elif len(filter_conditions) == 1:
-                    # Single filter
-                    filter_str = f"doc_id={document_id}" if document_id else f"tags={filter_tags}"
-                    print(f"🔍 Searching with filter: {filter_str} (top_k={search_top_k})")
-                    future = executor.submit(
-                        pinecone_index.query,
-                        vector=question_vector,
-                        top_k=search_top_k,
-                        include_metadata=True,
-                        filter=filter_conditions[0]
-                    )
-                    query_response = future.result(timeout=10.0)
-                else:
-                    # Multiple filters - use $and
-                    print(f"🔍 Searching with filters: doc_id={document_id}, tags={filter_tags} (top_k={search_top_k})")
-                    future = executor.submit(
-                        pinecone_index.query,
-                        vector=question_vector,
-                        top_k=search_top_k,
-                        include_metadata=True,
-                        filter={"$and": filter_conditions}
-                    )
-                    query_response = future.result(timeout=10.0)
+            if len(filter_conditions) == 0:
+                # No filters - search all documents
+                print(f"🔍 Searching across ALL documents (top_k={search_top_k})")
+                future = _PINECONE_QUERY_EXECUTOR.submit(
+                    pinecone_index.query,
+                    vector=question_vector,
+                    top_k=search_top_k,
+                    include_metadata=True
+                )
+                query_response = future.result(timeout=10.0)
+            elif len(filter_conditions) == 1:
+                # Single filter
+                filter_str = f"doc_id={document_id}" if document_id else f"tags={filter_tags}"
+                print(f"🔍 Searching with filter: {filter_str} (top_k={search_top_k})")
+                future = _PINECONE_QUERY_EXECUTOR.submit(
+                    pinecone_index.query,
+                    vector=question_vector,
+                    top_k=search_top_k,
+                    include_metadata=True,
+                    filter=filter_conditions[0]
+                )
+                query_response = future.result(timeout=10.0)
+            else:
+                # Multiple filters - use $and
+                print(f"🔍 Searching with filters: doc_id={document_id}, tags={filter_tags} (top_k={search_top_k})")
+                future = _PINECONE_QUERY_EXECUTOR.submit(
+                    pinecone_index.query,
+                    vector=question_vector,
+                    top_k=search_top_k,
+                    include_metadata=True,
+                    filter={"$and": filter_conditions}
+                )
+                query_response = future.result(timeout=10.0)
         except (FuturesTimeoutError, TimeoutError):
             print(f"⏱️ Pinecone query timed out after 10 seconds")
             return JSONResponse(
@@ -4267,7 +4340,7 @@ def generate_qa_pairs_sonnet(chunk: str) -> list[dict]:
         return []
     
     try:
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+        client = get_anthropic_client(ANTHROPIC_API_KEY)
         
         message = client.messages.create(
             model="claude-sonnet-4-5-20250929",
@@ -6060,11 +6133,15 @@ async def upload_audio(file: UploadFile = File(...)):
                 batch_size = 50
                 total_batches = (len(vectors_to_upsert) + batch_size - 1) // batch_size
                 
-                for batch_num in range(0, len(vectors_to_upsert), batch_size):
-                    batch = vectors_to_upsert[batch_num:batch_num + batch_size]
-                    pinecone_index.upsert(vectors=batch)
-                    current_batch = (batch_num // batch_size) + 1
-                    print(f"📤 Uploaded batch {current_batch}/{total_batches} ({len(batch)} vectors)")
+                try:
+                    for batch_num in range(0, len(vectors_to_upsert), batch_size):
+                        batch = vectors_to_upsert[batch_num:batch_num + batch_size]
+                        pinecone_index.upsert(vectors=batch)
+                        current_batch = (batch_num // batch_size) + 1
+                        print(f"📤 Uploaded batch {current_batch}/{total_batches} ({len(batch)} vectors)")
+                finally:
+                    # Once per upload, also after a partial one
+                    invalidate_rag_cache()
                 
                 print(f"✅ Successfully indexed {len(vectors_to_upsert)} chunks in Pinecone")
             
@@ -6595,11 +6672,15 @@ async def download_youtube(request: YouTubeDownloadRequest):
                 batch_size = 50
                 total_batches = (len(vectors_to_upsert) + batch_size - 1) // batch_size
                 
-                for batch_num in range(0, len(vectors_to_upsert), batch_size):
-                    batch = vectors_to_upsert[batch_num:batch_num + batch_size]
-                    pinecone_index.upsert(vectors=batch)
-                    current_batch = (batch_num // batch_size) + 1
-                    print(f"📤 Uploaded batch {current_batch}/{total_batches} ({len(batch)} vectors)")
+                try:
+                    for batch_num in range(0, len(vectors_to_upsert), batch_size):
+                        batch = vectors_to_upsert[batch_num:batch_num + batch_size]
+                        pinecone_index.upsert(vectors=batch)
+                        current_batch = (batch_num // batch_size) + 1
+                        print(f"📤 Uploaded batch {current_batch}/{total_batches} ({len(batch)} vectors)")
+                finally:
+                    # Once per upload, also after a partial one
+                    invalidate_rag_cache()
                 
                 print(f"✅ Successfully indexed {len(vectors_to_upsert)} chunks in Pinecone")
             
@@ -6876,11 +6957,15 @@ Return ONLY the cleaned transcript with proper formatting, nothing else."""
                 batch_size = 50
                 total_batches = (len(vectors_to_upsert) + batch_size - 1) // batch_size
                 
-                for batch_num in range(0, len(vectors_to_upsert), batch_size):
-                    batch = vectors_to_upsert[batch_num:batch_num + batch_size]
-                    pinecone_index.upsert(vectors=batch)
-                    current_batch = (batch_num // batch_size) + 1
-                    print(f"📤 Uploaded batch {current_batch}/{total_batches} ({len(batch)} vectors)")
+                try:
+                    for batch_num in range(0, len(vectors_to_upsert), batch_size):
+                        batch = vectors_to_upsert[batch_num:batch_num + batch_size]
+                        pinecone_index.upsert(vectors=batch)
+                        current_batch = (batch_num // batch_size) + 1
+                        print(f"📤 Uploaded batch {current_batch}/{total_batches} ({len(batch)} vectors)")
+                finally:
+                    # Once per upload, also after a partial one
+                    invalidate_rag_cache()
                 
                 print(f"✅ Successfully indexed {len(vectors_to_upsert)} chunks in Pinecone")
             
@@ -7971,13 +8056,10 @@ Answer naturally as an enthusiastic typology expert based on the transcript cont
         
         async def generate_and_cache():
             """Generate fresh content using Claude API, stream it, AND save to cache"""
-            import anthropic
-            import json
-            
             full_response = ""
             
             try:
-                client = anthropic.AsyncAnthropic(api_key=anthropic_api_key)
+                client = get_async_anthropic_client(anthropic_api_key)
                 
                 # Stream directly from Claude API (ASYNC!)
                 async with client.messages.stream(
@@ -8762,6 +8844,9 @@ async def batch_retag_documents():
                 print(f"   ⏭️ Skipping to next document...")
                 continue
         
+        # Retrieval caches are dropped once for the whole job, not per document
+        invalidate_rag_cache()
+        
         # Summary
         print("\n" + "="*60)
         print("✅ BATCH RE-TAGGING COMPLETE")
@@ -8784,6 +8869,7 @@ async def batch_retag_documents():
         
     except Exception as e:
         print(f"\n❌ FATAL ERROR in batch re-tagging: {str(e)}")
+        invalidate_rag_cache()  # Documents re-tagged before the failure are already live
         return JSONResponse(status_code=500, content={
             "error": f"Batch re-tagging failed: {str(e)}"
         })
@@ -9101,6 +9187,9 @@ OUTPUT FORMAT:
                 print(f"   ⏭️ Skipping to next document...\n")
                 continue
         
+        # Retrieval caches are dropped once for the whole job, not per document
+        invalidate_rag_cache()
+        
         # Summary
         print("\n" + "="*80)
         print("✅ ULTIMATE BATCH OPTIMIZATION COMPLETE!")
@@ -9129,6 +9218,7 @@ OUTPUT FORMAT:
         print(f"\n❌ FATAL ERROR: {str(e)}")
         import traceback
         traceback.print_exc()
+        invalidate_rag_cache()  # Documents optimized before the failure are already live
         return JSONResponse(status_code=500, content={
             "error": f"Batch optimization failed: {str(e)}"
         })
@@ -9394,12 +9484,16 @@ OUTPUT FORMAT:
                     yield f"data: {json.dumps(error_data)}\n\n"
                     continue
             
+            # Retrieval caches are dropped once for the whole job, not per document
+            invalidate_rag_cache()
+            
             # Send final completion
             total_elapsed = (datetime.now() - start_time).total_seconds()
             complete_data = {'type': 'complete', 'total_documents': total_documents, 'processed': processed, 'failed': failed, 'total_vectors': updated_vectors, 'elapsed_seconds': int(total_elapsed)}
             yield f"data: {json.dumps(complete_data)}\n\n"
             
         except Exception as e:
+            invalidate_rag_cache()  # Documents optimized before the failure are already live
             # Send error event if something catastrophic happens
             yield f"data: {json.dumps({'type': 'fatal_error', 'error': str(e)})}\n\n"
     
@@ -9415,13 +9509,18 @@ OUTPUT FORMAT:
 
 
 # === Claude Chat Endpoints ===
-from claude_api import PROJECTS, chat_with_claude, chat_with_claude_streaming
+from claude_api import PROJECTS, chat_with_claude, chat_with_claude_streaming, invalidate_rag_cache, rag_cache_stats, SSE_RESPONSE_HEADERS, close_http_clients
 
 @app.get("/claude/projects")
 async def get_projects():
     """Get all project categories"""
     return {"projects": PROJECTS}
 
+@app.get("/claude/rag-cache/stats")
+async def get_rag_cache_stats():
+    """Retrieval cache hit rates for this worker (debugging cache effectiveness)"""
+    return rag_cache_stats()
+
 @app.post("/claude/conversations")
 async def create_conversation(request: Request):
     """Create a new conversation in a project"""
@@ -9651,7 +9750,10 @@ async def send_message(conversation_id: int, request: Request):
                 "content": msg["content"]
             })
         
-        assistant_response, tool_details, follow_up_question = chat_with_claude(claude_messages, conversation_id)
+        # Blocking SDK calls: run in a worker thread so the event loop keeps serving other requests
+        assistant_response, tool_details, follow_up_question = await asyncio.to_thread(
+            chat_with_claude, claude_messages, conversation_id
+        )
         
         cursor.execute("""
             INSERT INTO messages (conversation_id, role, content, follow_up_question)
@@ -9859,11 +9961,7 @@ async def send_message_streaming(conversation_id: int, request: Request):
         return StreamingResponse(
             generate(),
             media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no"
-            }
+            headers=SSE_RESPONSE_HEADERS
         )
         
     except HTTPException:
@@ -10463,6 +10561,9 @@ async def start_migration_api(background_tasks: BackgroundTasks):
                     print(f"❌ Error migrating {doc['filename']}: {str(e)}")
                     migration_status["failed"] += 1
             
+            # Retrieval caches are dropped once for the whole job, not per document
+            invalidate_rag_cache()
+            
             migration_status["end_time"] = datetime.now().isoformat()
             migration_status["running"] = False
             print(f"🎉 Migration complete! {migration_status['completed']}/{migration_status['total_docs']}")
@@ -10470,6 +10571,7 @@ async def start_migration_api(background_tasks: BackgroundTasks):
         except Exception as e:
             error_msg = f"Migration error: {str(e)}"
             print(f"❌ {error_msg}")
+            invalidate_rag_cache()  # Documents migrated before the failure are already live
             migration_status["error"] = error_msg
             migration_status["running"] = False
             migration_status["end_time"] = datetime.now().isoformat()
@@ -12178,28 +12280,27 @@ async def openai_chat_completions(request: Request):
             return StreamingResponse(
                 generate_openai_stream(),
                 media_type="text/event-stream",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                    "X-Accel-Buffering": "no"
-                }
+                headers=SSE_RESPONSE_HEADERS
             )
         
         else:
             # Non-streaming response (fallback)
-            full_response = []
             temp_conversation_id = 0
             
-            for chunk in chat_with_claude_streaming(claude_messages, temp_conversation_id):
-                if '"chunk"' in chunk:
-                    try:
-                        chunk_data = json.loads(chunk.replace("data: ", ""))
-                        if "chunk" in chunk_data:
-                            full_response.append(chunk_data["chunk"])
-                    except:
-                        pass
+            def collect_response_text():
+                full_response = []
+                for chunk in chat_with_claude_streaming(claude_messages, temp_conversation_id):
+                    if '"chunk"' in chunk:
+                        try:
+                            chunk_data = json.loads(chunk.replace("data: ", ""))
+                            if "chunk" in chunk_data:
+                                full_response.append(chunk_data["chunk"])
+                        except:
+                            pass
+                return "".join(full_response)
             
-            response_text = "".join(full_response)
+            # The generator blocks on SDK calls: drain it in a worker thread, not on the event loop
+            response_text = await asyncio.to_thread(collect_response_text)
             
             return {
                 "id": f"chatcmpl-{uuid.uuid4().hex[:8]}",
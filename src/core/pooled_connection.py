@@ -0,0 +1,135 @@
+"""
+Idle Connection Reuse for psycopg2
+Lets `conn = get_db_connection() ... conn.close()` call sites reuse warm connections.
+
+src.core.database's ThreadedConnectionPool is not used for main.py because its
+call sites:
+- index rows as tuples, while that pool hands out RealDictCursor connections
+- only ever call conn.close(), never putconn()
+- must keep working with DATABASE_URL unset, which Settings rejects at startup
+  (so the DB_POOL_* values are read from the environment by the caller instead)
+"""
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+import psycopg2
+import psycopg2.extensions
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Connection whose close() hands it back to its IdleConnectionPool instead of disconnecting"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.opened_at = time.time()
+        self.returned_at = self.opened_at
+        self.in_pool = False
+        self.pool = None
+
+    def close(self):
+        if self.pool is None:
+            return super().close()
+        self.pool.release(self)
+
+    def disconnect(self):
+        """Really close the connection"""
+        super().close()
+
+
+class IdleConnectionPool:
+    """
+    Bounded LIFO stack of idle connections.
+
+    Nothing is checked out from a fixed set: get() opens a new connection when
+    no idle one is usable, and release() keeps at most ``max_idle`` of them.
+    Serverless Postgres (Neon) drops connections while compute is suspended,
+    so an idle connection is only handed out again if it was returned less
+    than ``max_idle_time`` seconds ago and answers a ``SELECT 1`` ping.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], PooledConnection],
+        max_idle: int = 10,
+        max_age: float = 3600.0,
+        max_idle_time: float = 240.0,
+    ):
+        """
+        Args:
+            connect: Opens a new PooledConnection
+            max_idle: Max idle connections kept for reuse
+            max_age: Seconds after opening when a connection is no longer reused
+            max_idle_time: Seconds a connection may sit idle before it is discarded
+        """
+        self._connect = connect
+        self.max_idle = max_idle
+        self.max_age = max_age
+        self.max_idle_time = max_idle_time
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+    def get(self) -> PooledConnection:
+        """Return a live idle connection, or open a new one."""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn = self._idle.pop()  # Most recently used is least likely stale
+                conn.in_pool = False
+            if self._is_usable(conn):
+                return conn
+            conn.disconnect()
+
+        conn = self._connect()
+        conn.pool = self
+        return conn
+
+    def _is_usable(self, conn) -> bool:
+        now = time.time()
+        if conn.closed or now - conn.opened_at > self.max_age or now - conn.returned_at > self.max_idle_time:
+            return False
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()  # End the transaction the ping opened
+            return True
+        except psycopg2.Error:
+            return False
+
+    def release(self, conn) -> None:
+        """Take back a closed-by-caller connection, or disconnect it if it can't be reused."""
+        if conn.in_pool:
+            return  # Already returned (close() called twice)
+        if conn.closed or time.time() - conn.opened_at > self.max_age:
+            conn.disconnect()
+            return
+        try:
+            # Never hand out a connection with a half-finished transaction
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.autocommit:
+                conn.autocommit = False
+        except psycopg2.Error:
+            conn.disconnect()
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                conn.in_pool = True
+                conn.returned_at = time.time()
+                self._idle.append(conn)
+                return
+        conn.disconnect()
+
+    def close_all(self) -> None:
+        """Disconnect every idle connection (for shutdown)."""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn in idle:
+            conn.in_pool = False
+            conn.disconnect()
+
+    def __len__(self) -> int:
+        return len(self._idle)
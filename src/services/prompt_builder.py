@@ -5,6 +5,7 @@ Ensures reference data injection reaches Claude reliably.
 
 import re
 import hashlib
+from functools import lru_cache
 from typing import Optional
 from pathlib import Path
 from .type_injection import load_reference_data, get_type_stack, format_stack_for_prompt, detect_types_in_message, normalize_message_content
@@ -14,6 +15,13 @@ from .conversation_context import ConversationContext
 _CACHED_BASE_TEMPLATE = None
 
 
+@lru_cache(maxsize=None)
+def _type_stack_block(type_code: str) -> Optional[str]:
+    """Formatted reference block for one type (reference data is static, so each type is formatted once)."""
+    type_data = get_type_stack(type_code)
+    return format_stack_for_prompt(type_data) if type_data else None
+
+
 class PromptAssemblyError(Exception):
     """Raised when prompt assembly fails validation."""
     pass
@@ -149,9 +157,9 @@ The user has uploaded CS Joseph's authoritative typology database. Respect it.
         
         injected = []
         for type_code in detected:
-            type_data = get_type_stack(type_code)
-            if type_data:
-                injection_parts.append(format_stack_for_prompt(type_data))
+            type_block = _type_stack_block(type_code)
+            if type_block:
+                injection_parts.append(type_block)
                 injected.append(type_code)
             else:
                 print(f"⚠️ [PROMPT BUILDER] No reference data for {type_code}")
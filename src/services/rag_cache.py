@@ -0,0 +1,449 @@
+"""
+RAG Semantic Cache
+Similarity-keyed result cache in front of knowledge-base retrieval.
+
+Users re-ask the same MBTI questions with different wording ("INFJ four sides?"
+vs "what are the four sides of INFJ"). Instead of hitting Pinecone again, a
+lookup returns the stored result of the closest cached question embedding when
+the cosine similarity clears a threshold.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import operator
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_vector(vector: Sequence[float]) -> List[float]:
+    """Scale a vector to unit length so cosine similarity becomes a plain dot product."""
+    norm = math.hypot(*vector)  # Euclidean norm in one C call
+    if norm == 0:
+        return list(vector)
+    return [v / norm for v in vector]
+
+
+def _map_sum_dot(a: Sequence[float], b: Sequence[float]) -> float:
+    """Dot product evaluated in C via map/sum (no per-element Python bytecode)."""
+    return sum(map(operator.mul, a, b))
+
+
+# math.sumprod (Python 3.12+) is a single C loop without a float object per
+# element, several times faster on 3072-dim embeddings; map/sum elsewhere.
+dot: Callable[[Sequence[float], Sequence[float]], float] = getattr(math, "sumprod", _map_sum_dot)
+
+
+def question_key(question: str) -> str:
+    """Stable key for a question, ignoring case and whitespace differences."""
+    normalized = " ".join(question.lower().split())
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _cache_stats(size: int, hits: int, misses: int) -> Dict[str, Any]:
+    lookups = hits + misses
+    return {
+        "size": size,
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+    }
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key.
+
+    While a call for a key is running, other callers with the same key wait for
+    its result instead of repeating the work. Covers the window before a result
+    reaches SemanticCache, when two users send the same question seconds apart.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Run fn() for key, or wait for the call already in flight. Errors propagate to all waiters."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = Future()
+                self._calls[key] = call
+
+        if not leader:
+            return call.result()
+
+        try:
+            result = fn()
+            call.set_result(result)
+            return result
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class TTLCache:
+    """
+    Bounded LRU + TTL cache for exact keys (e.g. question_key()).
+
+    The cheap first layer in front of SemanticCache: an exact repeat is answered
+    before any filter extraction, embedding lookup or similarity scan.
+
+    Pass ``generation`` (e.g. SemanticCache.generation) to follow another
+    cache's clears: entries are dropped whenever the generation it reports has
+    changed, so a clear() in any worker sharing that cache's file also empties
+    this per-process layer.
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 600.0, generation: Optional[Callable[[], int]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation_source = generation
+        self._generation = generation() if generation else 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the value for key, or None when missing or expired."""
+        generation = self._generation_source() if self._generation_source else self._generation
+        with self._lock:
+            if generation != self._generation:
+                self._entries.clear()
+                self._generation = generation
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Store a value, evicting the least recently used entry when full."""
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Size and lifetime hit/miss counts."""
+        return _cache_stats(len(self._entries), self.hits, self.misses)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class EmbeddingStore:
+    """
+    SQLite-backed store of embedding vectors keyed by a content digest.
+
+    Embeddings are deterministic for a given model and text, so entries never
+    expire; the table is trimmed to the ``maxsize`` most recently written rows.
+    Sits behind the in-process embedding LRU so restarted or sibling workers
+    skip the embeddings round-trip for questions already seen.
+    """
+
+    def __init__(self, db_path: str, maxsize: int = 20_000):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db: Optional[sqlite3.Connection] = None
+        try:
+            db = sqlite3.connect(db_path, timeout=5.0, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS embedding_cache (
+                    key BLOB PRIMARY KEY,
+                    embedding BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_created ON embedding_cache(created_at)")
+            db.commit()
+            self._db = db
+        except sqlite3.Error as e:
+            logger.warning("⚠️ [EMBEDDING STORE] Persistence disabled, could not open %s: %s", db_path, e)
+
+    def get(self, key: bytes) -> Optional[array]:
+        """Return the stored float32 vector for key, or None."""
+        if self._db is None:
+            return None
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT embedding FROM embedding_cache WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("⚠️ [EMBEDDING STORE] Lookup failed: %s", e)
+            return None
+        if row is None:
+            return None
+        vector = array("f")
+        vector.frombytes(row[0])
+        return vector
+
+    def put(self, key: bytes, vector: Sequence[float]) -> None:
+        """Store a vector, trimming the oldest rows every few hundred writes."""
+        if self._db is None:
+            return
+        packed = vector if isinstance(vector, array) and vector.typecode == "f" else array("f", vector)
+        try:
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embedding_cache (key, embedding, created_at) VALUES (?, ?, ?)",
+                    (key, packed.tobytes(), time.time()),
+                )
+                self._writes += 1
+                if self._writes % 256 == 0:
+                    self._db.execute(
+                        "DELETE FROM embedding_cache WHERE key NOT IN "
+                        "(SELECT key FROM embedding_cache ORDER BY created_at DESC LIMIT ?)",
+                        (self.maxsize,),
+                    )
+                self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning("⚠️ [EMBEDDING STORE] Could not persist embedding: %s", e)
+
+
+class SemanticCache:
+    """
+    Bounded LRU + TTL cache keyed by embedding similarity.
+
+    Entries are grouped by an optional ``scope`` (e.g. the metadata filters the
+    result was retrieved with) and only match lookups from the same scope, so
+    "INFJ four sides" never answers "INTJ four sides" even though the two
+    embeddings are nearly identical.
+
+    With ``db_path`` set, entries are also written to a SQLite file shared by
+    every worker process: new workers start warm, entries cached by one worker
+    are picked up by the others on their next lookup, and clear() propagates
+    through a shared generation counter. Persisted values and scopes must be JSON-serializable.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 256,
+        ttl: float = 600.0,
+        threshold: float = 0.95,
+        db_path: Optional[str] = None,
+    ):
+        """
+        Args:
+            maxsize: Max entries before the least recently used one is evicted
+            ttl: Seconds an entry stays valid
+            threshold: Minimum cosine similarity for a hit (0.95 = distance < 0.05)
+            db_path: Optional SQLite file for cross-process persistence
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._last_row_id = 0
+        self._generation = 0
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str) -> None:
+        """Open (or create) the shared cache file. Persistence is skipped if it fails."""
+        try:
+            db = sqlite3.connect(db_path, timeout=5.0, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS semantic_cache (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    scope TEXT,
+                    embedding BLOB NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS idx_semantic_cache_expires ON semantic_cache(expires_at)")
+            db.execute("CREATE TABLE IF NOT EXISTS semantic_cache_meta (key TEXT PRIMARY KEY, value REAL)")
+            db.commit()
+            self._db = db
+            self._generation = self._read_generation()
+        except sqlite3.Error as e:
+            logger.warning("⚠️ [SEMANTIC CACHE] Persistence disabled, could not open %s: %s", db_path, e)
+            self._db = None
+
+    def _read_generation(self) -> int:
+        row = self._db.execute(
+            "SELECT value FROM semantic_cache_meta WHERE key = 'generation'"
+        ).fetchone()
+        return int(row[0]) if row else 0
+
+    def _sync_generation(self) -> None:
+        """Drop local entries if another instance cleared the shared file since the last check."""
+        generation = self._read_generation()
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+    def _sync_from_db(self, now: float) -> None:
+        """Pull entries written since the last sync (by any process) into memory."""
+        try:
+            self._sync_generation()
+            rows = self._db.execute(
+                "SELECT id, scope, embedding, value, expires_at FROM semantic_cache "
+                "WHERE id > ? AND expires_at > ? ORDER BY id",
+                (self._last_row_id, now),
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("⚠️ [SEMANTIC CACHE] Sync failed: %s", e)
+            return
+
+        for row_id, scope, embedding, value, expires_at in rows:
+            vector = array("f")
+            vector.frombytes(embedding)
+            self._entries[("db", row_id)] = (
+                vector,
+                json.loads(scope) if scope is not None else None,
+                json.loads(value),
+                expires_at,
+            )
+            self._last_row_id = row_id
+        self._evict_overflow()
+
+    def _evict_overflow(self) -> None:
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, embedding: Sequence[float], scope: Hashable = None) -> Optional[Any]:
+        """
+        Return the cached value for the most similar embedding, or None on a miss.
+        """
+        query = normalize_vector(embedding)
+        now = time.time()
+
+        with self._lock:
+            if self._db is not None:
+                self._sync_from_db(now)
+
+            best_id, best_score = None, self.threshold
+            expired = []
+
+            for entry_id, (vector, entry_scope, value, expires_at) in self._entries.items():
+                if expires_at <= now:
+                    expired.append(entry_id)
+                    continue
+                if entry_scope != scope:
+                    continue
+                score = dot(vector, query)
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+
+            for entry_id in expired:
+                del self._entries[entry_id]
+
+            if best_id is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id][2]
+
+    def put(self, embedding: Sequence[float], value: Any, scope: Hashable = None) -> None:
+        """Store a value under an embedding, evicting the LRU entry when full."""
+        vector = normalize_vector(embedding)
+        now = time.time()
+        expires_at = now + self.ttl
+
+        with self._lock:
+            if self._db is not None and self._persist(vector, scope, value, now, expires_at):
+                # The row reaches memory through the next sync, like entries from other workers
+                return
+
+            self._entries[self._next_id] = (vector, scope, value, expires_at)
+            self._next_id += 1
+            self._evict_overflow()
+
+    def _persist(self, vector: List[float], scope: Hashable, value: Any, now: float, expires_at: float) -> bool:
+        """Write an entry to the shared file and purge expired rows. Returns False on failure."""
+        try:
+            self._db.execute(
+                "INSERT INTO semantic_cache (scope, embedding, value, expires_at) VALUES (?, ?, ?, ?)",
+                (
+                    json.dumps(scope) if scope is not None else None,
+                    array("f", vector).tobytes(),
+                    json.dumps(value),
+                    expires_at,
+                ),
+            )
+            self._db.execute("DELETE FROM semantic_cache WHERE expires_at <= ?", (now,))
+            self._db.commit()
+            return True
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning("⚠️ [SEMANTIC CACHE] Could not persist entry: %s", e)
+            return False
+
+    def clear(self) -> None:
+        """Drop every entry (call after the knowledge base changes)."""
+        with self._lock:
+            self._entries.clear()
+            if self._db is None:
+                self._generation += 1
+                return
+            try:
+                self._db.execute("DELETE FROM semantic_cache")
+                self._db.execute(
+                    "INSERT INTO semantic_cache_meta (key, value) VALUES ('generation', 1) "
+                    "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+                )
+                self._db.commit()
+                self._generation = self._read_generation()
+            except sqlite3.Error as e:
+                logger.warning("⚠️ [SEMANTIC CACHE] Could not clear persisted entries: %s", e)
+                self._generation += 1
+
+    def generation(self) -> int:
+        """
+        Counter bumped by every clear(), including clears by other instances
+        sharing the file. Lets per-process layers in front of this cache
+        notice that their entries are stale.
+        """
+        with self._lock:
+            if self._db is not None:
+                try:
+                    self._sync_generation()
+                except sqlite3.Error as e:
+                    logger.warning("⚠️ [SEMANTIC CACHE] Could not read the clear generation: %s", e)
+            return self._generation
+
+    def stats(self) -> Dict[str, Any]:
+        """Size and lifetime hit/miss counts for this process."""
+        return _cache_stats(len(self._entries), self.hits, self.misses)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,159 @@
+"""
+Tests for Idle Connection Reuse
+"""
+import psycopg2
+import psycopg2.extensions
+
+from src.core.pooled_connection import IdleConnectionPool
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql):
+        if self.conn.dead:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.conn.pings += 1
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Stands in for PooledConnection: close() goes through the pool's release()"""
+
+    def __init__(self, pool, now):
+        self.pool = pool
+        self.opened_at = now
+        self.returned_at = now
+        self.in_pool = False
+        self.closed = 0
+        self.dead = False
+        self.pings = 0
+        self.rollbacks = 0
+        self.autocommit = False
+        self.info = type("Info", (), {"transaction_status": psycopg2.extensions.TRANSACTION_STATUS_IDLE})()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.pool.release(self)
+
+    def disconnect(self):
+        self.closed = 1
+
+
+def make_pool(monkeypatch, **kwargs):
+    now = [1000.0]
+    monkeypatch.setattr("src.core.pooled_connection.time.time", lambda: now[0])
+    opened = []
+
+    def connect():
+        conn = FakeConnection(pool, now[0])
+        opened.append(conn)
+        return conn
+
+    pool = IdleConnectionPool(connect, **kwargs)
+    return pool, now, opened
+
+
+def test_close_returns_connection_for_reuse(monkeypatch):
+    """Test that a closed connection is handed out again after a successful ping"""
+    pool, now, opened = make_pool(monkeypatch)
+    conn = pool.get()
+    conn.close()
+
+    assert len(pool) == 1
+    assert pool.get() is conn
+    assert conn.pings == 1
+    assert len(opened) == 1
+
+
+def test_double_close_returns_connection_once(monkeypatch):
+    """Test that calling close() twice doesn't pool the connection twice"""
+    pool, now, opened = make_pool(monkeypatch)
+    conn = pool.get()
+    conn.close()
+    conn.close()
+
+    assert len(pool) == 1
+    assert pool.get() is conn
+    assert pool.get() is not conn
+
+
+def test_release_rolls_back_open_transaction(monkeypatch):
+    """Test that a connection left mid-transaction is rolled back before pooling"""
+    pool, now, opened = make_pool(monkeypatch)
+    conn = pool.get()
+    conn.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    conn.autocommit = True
+    conn.close()
+
+    assert conn.rollbacks == 1
+    assert conn.autocommit is False
+    assert len(pool) == 1
+
+
+def test_connection_idle_too_long_is_discarded(monkeypatch):
+    """Test that a connection idle past max_idle_time is disconnected, not reused"""
+    pool, now, opened = make_pool(monkeypatch, max_idle_time=240)
+    conn = pool.get()
+    conn.close()
+    now[0] += 241
+
+    fresh = pool.get()
+    assert fresh is not conn
+    assert conn.closed
+    assert conn.pings == 0
+
+
+def test_dead_connection_fails_ping_and_is_replaced(monkeypatch):
+    """Test that a connection the server dropped is detected on checkout"""
+    pool, now, opened = make_pool(monkeypatch)
+    conn = pool.get()
+    conn.close()
+    conn.dead = True
+
+    fresh = pool.get()
+    assert fresh is not conn
+    assert conn.closed
+    assert len(opened) == 2
+
+
+def test_connection_past_max_age_is_recycled(monkeypatch):
+    """Test that old connections are disconnected on close instead of pooled"""
+    pool, now, opened = make_pool(monkeypatch, max_age=3600)
+    conn = pool.get()
+    now[0] += 3601
+    conn.close()
+
+    assert conn.closed
+    assert len(pool) == 0
+
+
+def test_pool_keeps_at_most_max_idle(monkeypatch):
+    """Test that connections beyond max_idle are disconnected on close"""
+    pool, now, opened = make_pool(monkeypatch, max_idle=1)
+    first, second = pool.get(), pool.get()
+    first.close()
+    second.close()
+
+    assert len(pool) == 1
+    assert second.closed
+
+
+def test_close_all_disconnects_idle_connections(monkeypatch):
+    """Test that close_all() empties the pool"""
+    pool, now, opened = make_pool(monkeypatch)
+    conn = pool.get()
+    conn.close()
+    pool.close_all()
+
+    assert len(pool) == 0
+    assert conn.closed
@@ -0,0 +1,175 @@
+"""
+Tests for Chat Prompt and Streaming Helpers
+"""
+import claude_api
+from claude_api import DeltaCoalescer, build_openai_messages, chunk_frame, select_context_chunks
+
+
+def turns(count, chars=10):
+    """Alternating user/assistant messages, starting with user"""
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": str(i).ljust(chars, "x")}
+        for i in range(count)
+    ]
+
+
+def test_build_openai_messages_keeps_short_history():
+    """Test that a short conversation is passed through after the system message"""
+    messages = build_openai_messages("SYS", turns(3))
+
+    assert messages[0] == {"role": "system", "content": "SYS"}
+    assert [m["role"] for m in messages[1:]] == ["user", "assistant", "user"]
+
+
+def test_build_openai_messages_windows_by_count(monkeypatch):
+    """Test that only the most recent MAX_HISTORY_MESSAGES turns are kept"""
+    monkeypatch.setattr(claude_api, "MAX_HISTORY_MESSAGES", 4)
+    history = turns(9)
+    messages = build_openai_messages("SYS", history)
+
+    assert messages[1:] == history[-4:][1:]  # Window of 4 drops its leading assistant turn
+    assert messages[-1] == history[-1]
+
+
+def test_build_openai_messages_windows_by_chars(monkeypatch):
+    """Test that the oldest turns are dropped once MAX_HISTORY_CHARS is exceeded"""
+    monkeypatch.setattr(claude_api, "MAX_HISTORY_CHARS", 35)
+    history = turns(7)
+    messages = build_openai_messages("SYS", history)
+
+    assert messages[1:] == history[-3:]
+    assert sum(len(m["content"]) for m in messages[1:]) <= 35
+
+
+def test_build_openai_messages_never_starts_on_assistant(monkeypatch):
+    """Test that the window skips forward past a leading assistant turn"""
+    monkeypatch.setattr(claude_api, "MAX_HISTORY_MESSAGES", 3)
+    history = turns(6)  # Last 3 are assistant, user, assistant
+    messages = build_openai_messages("SYS", history)
+
+    assert messages[1]["role"] == "user"
+    assert messages[1:] == history[-2:]
+
+
+def test_build_openai_messages_always_keeps_latest(monkeypatch):
+    """Test that the latest message survives even when it alone exceeds the budget"""
+    monkeypatch.setattr(claude_api, "MAX_HISTORY_CHARS", 5)
+    history = turns(3, chars=50)
+    messages = build_openai_messages("SYS", history)
+
+    assert messages[1:] == history[-1:]
+
+
+def test_delta_coalescer_flushes_on_size(monkeypatch):
+    """Test that deltas are merged into one frame once max_chars is reached"""
+    monkeypatch.setattr(claude_api.time, "monotonic", lambda: 100.0)
+    coalescer = DeltaCoalescer(max_chars=10, max_delay=1.0)
+
+    assert coalescer.add("hello") is None
+    assert coalescer.add(" world") == chunk_frame("hello world")
+    assert coalescer.flush() is None
+
+
+def test_delta_coalescer_flushes_on_time(monkeypatch):
+    """Test that a small buffer is flushed once max_delay has passed"""
+    now = [100.0]
+    monkeypatch.setattr(claude_api.time, "monotonic", lambda: now[0])
+    coalescer = DeltaCoalescer(max_chars=256, max_delay=0.03)
+
+    assert coalescer.add("a") is None
+    now[0] += 0.05
+    assert coalescer.add("b") == chunk_frame("ab")
+
+
+def test_delta_coalescer_poll_flushes_on_time(monkeypatch):
+    """Test that a delta without text releases buffered text once max_delay has passed"""
+    now = [100.0]
+    monkeypatch.setattr(claude_api.time, "monotonic", lambda: now[0])
+    coalescer = DeltaCoalescer(max_chars=256, max_delay=0.03)
+
+    assert coalescer.poll() is None
+    coalescer.add("a")
+    assert coalescer.poll() is None
+    now[0] += 0.05
+    assert coalescer.poll() == chunk_frame("a")
+    assert coalescer.poll() is None
+
+
+def test_delta_coalescer_flush_returns_remainder(monkeypatch):
+    """Test that flush() emits whatever is buffered at the end of a stream"""
+    monkeypatch.setattr(claude_api.time, "monotonic", lambda: 100.0)
+    coalescer = DeltaCoalescer(max_chars=256, max_delay=1.0)
+    coalescer.add("tail")
+
+    assert coalescer.flush() == chunk_frame("tail")
+
+
+def test_select_context_chunks_respects_count_budget():
+    """Test that at most max_chunks chunks are selected, in rank order"""
+    chunks = [{"text": f"distinct chunk number {i}"} for i in range(5)]
+    selected = select_context_chunks(chunks, max_chunks=3)
+
+    assert selected == chunks[:3]
+
+
+def test_select_context_chunks_respects_char_budget():
+    """Test that selection stops before the character budget is exceeded"""
+    chunks = [{"text": f"{i} " + f"word{i} " * 8} for i in range(3)]
+    budget = len(chunks[0]["text"]) + len(chunks[1]["text"])
+    selected = select_context_chunks(chunks, max_chars=budget)
+
+    assert selected == chunks[:2]
+
+
+def test_select_context_chunks_keeps_best_chunk_over_budget():
+    """Test that the top-ranked chunk is kept even when it alone exceeds the budget"""
+    chunks = [{"text": "one two three four five"}]
+
+    assert select_context_chunks(chunks, max_chars=5) == chunks
+
+
+def test_select_context_chunks_skips_near_duplicates():
+    """Test that a chunk mostly overlapping a selected one is skipped"""
+    base = " ".join(f"w{i}" for i in range(20))
+    chunks = [
+        {"text": base},
+        {"text": base + " extra"},  # 20/21 shared words
+        {"text": "something else entirely"},
+    ]
+    selected = select_context_chunks(chunks)
+
+    assert selected == [chunks[0], chunks[2]]
+
+
+def test_select_context_chunks_trims_oversized_excerpt():
+    """Test that long excerpts are trimmed without mutating the input chunk"""
+    chunk = {"text": "word " * 1000, "score": 0.9}
+    selected = select_context_chunks([chunk])
+
+    assert len(selected[0]["text"]) <= claude_api.RAG_CHUNK_MAX_CHARS + 1
+    assert selected[0]["score"] == 0.9
+    assert len(chunk["text"]) == 5000
+
+
+def test_chat_prefetch_miss_keeps_knowledge_base_tool(monkeypatch):
+    """Test that a pre-fetch with no excerpts injects nothing and keeps the search tool"""
+    requests = []
+
+    def fake_call(client, **kwargs):
+        requests.append(kwargs)
+        raise Exception("The chat service is temporarily busy.")
+
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+    monkeypatch.setattr(claude_api, "get_chat_client", lambda api_key: object())
+    monkeypatch.setattr(claude_api, "build_system_prompt", lambda **kwargs: ("SYS", {}))
+    monkeypatch.setattr(
+        claude_api, "query_innerverse_local",
+        lambda question: "No relevant MBTI content found in knowledge base."
+    )
+    monkeypatch.setattr(claude_api, "make_openrouter_api_call_with_retry", fake_call)
+
+    reply, _, _ = claude_api.chat_with_claude([{"role": "user", "content": "What is Ni?"}], conversation_id=1)
+
+    assert "temporarily busy" in reply
+    assert requests[0]["tools"] is claude_api.CHAT_TOOLS
+    assert requests[0]["messages"][0] == {"role": "system", "content": "SYS"}
@@ -0,0 +1,259 @@
+"""
+Tests for RAG Semantic Cache
+"""
+import threading
+import time
+
+import pytest
+
+from src.services.rag_cache import EmbeddingStore, SemanticCache, SingleFlight, TTLCache, normalize_vector, question_key
+
+
+def test_normalize_vector_unit_length():
+    """Test that normalized vectors have unit length"""
+    vector = normalize_vector([3.0, 4.0])
+    assert vector == pytest.approx([0.6, 0.8])
+
+
+def test_semantic_cache_hit_on_similar_embedding():
+    """Test that a near-duplicate embedding returns the cached value"""
+    cache = SemanticCache(threshold=0.95)
+    cache.put([1.0, 0.0, 0.0], "result")
+
+    assert cache.get([0.99, 0.05, 0.0]) == "result"
+
+
+def test_semantic_cache_miss_on_dissimilar_embedding():
+    """Test that an unrelated embedding misses"""
+    cache = SemanticCache(threshold=0.95)
+    cache.put([1.0, 0.0, 0.0], "result")
+
+    assert cache.get([0.0, 1.0, 0.0]) is None
+
+
+def test_semantic_cache_scope_isolation():
+    """Test that entries only match lookups from the same scope"""
+    cache = SemanticCache()
+    cache.put([1.0, 0.0], "infj", scope="INFJ")
+
+    assert cache.get([1.0, 0.0], scope="INTJ") is None
+    assert cache.get([1.0, 0.0], scope="INFJ") == "infj"
+
+
+def test_semantic_cache_ttl_expiry(monkeypatch):
+    """Test that expired entries are not returned"""
+    cache = SemanticCache(ttl=10)
+    now = [1000.0]
+    monkeypatch.setattr("src.services.rag_cache.time.time", lambda: now[0])
+
+    cache.put([1.0, 0.0], "result")
+    now[0] += 11
+
+    assert cache.get([1.0, 0.0]) is None
+    assert len(cache) == 0
+
+
+def test_semantic_cache_evicts_least_recently_used():
+    """Test LRU eviction when the cache is full"""
+    cache = SemanticCache(maxsize=2)
+    cache.put([1.0, 0.0, 0.0], "a")
+    cache.put([0.0, 1.0, 0.0], "b")
+
+    # Touch "a" so "b" becomes least recently used
+    assert cache.get([1.0, 0.0, 0.0]) == "a"
+    cache.put([0.0, 0.0, 1.0], "c")
+
+    assert cache.get([0.0, 1.0, 0.0]) is None
+    assert cache.get([1.0, 0.0, 0.0]) == "a"
+    assert cache.get([0.0, 0.0, 1.0]) == "c"
+
+
+def test_semantic_cache_clear():
+    """Test that clear drops every entry"""
+    cache = SemanticCache()
+    cache.put([1.0, 0.0], "result")
+    cache.clear()
+
+    assert len(cache) == 0
+    assert cache.get([1.0, 0.0]) is None
+
+
+def test_semantic_cache_stats_count_hits_and_misses():
+    """Test that lookups are counted in stats()"""
+    cache = SemanticCache()
+    cache.put([1.0, 0.0], "result")
+    cache.get([1.0, 0.0])
+    cache.get([0.0, 1.0])
+
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_semantic_cache_persists_across_instances(tmp_path):
+    """Test that a second cache on the same file starts warm"""
+    db_path = str(tmp_path / "cache.db")
+    writer = SemanticCache(db_path=db_path)
+    writer.put([1.0, 0.0], ["context", {"sources": []}], scope="scope")
+
+    reader = SemanticCache(db_path=db_path)
+    assert reader.get([1.0, 0.0], scope="scope") == ["context", {"sources": []}]
+    assert writer.get([1.0, 0.0], scope="scope") == ["context", {"sources": []}]
+
+
+def test_semantic_cache_clear_propagates_across_instances(tmp_path):
+    """Test that clearing one cache invalidates the others sharing the file"""
+    db_path = str(tmp_path / "cache.db")
+    first = SemanticCache(db_path=db_path)
+    second = SemanticCache(db_path=db_path)
+    first.put([1.0, 0.0], "result")
+    assert second.get([1.0, 0.0]) == "result"
+
+    first.clear()
+
+    assert second.get([1.0, 0.0]) is None
+
+
+def test_semantic_cache_repeated_clears_propagate(tmp_path, monkeypatch):
+    """Test that every clear reaches the other instances, even within one clock tick"""
+    monkeypatch.setattr("src.services.rag_cache.time.time", lambda: 1000.0)
+    db_path = str(tmp_path / "cache.db")
+    first = SemanticCache(db_path=db_path)
+    second = SemanticCache(db_path=db_path)
+
+    for _ in range(2):
+        second.put([1.0, 0.0], "stale")
+        assert second.get([1.0, 0.0]) == "stale"
+        first.clear()
+        assert second.get([1.0, 0.0]) is None
+
+
+def test_question_key_ignores_case_and_whitespace():
+    """Test that trivially different spellings share a key"""
+    assert question_key("INFJ four sides?") == question_key("  infj  four sides? ")
+    assert question_key("INFJ four sides?") != question_key("INTJ four sides?")
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    """Test that concurrent callers with the same key share one call"""
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(timeout=5)
+        return "result"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("key", work)))
+    leader.start()
+    started.wait(timeout=5)
+    follower = threading.Thread(target=lambda: results.append(flight.do("key", work)))
+    follower.start()
+    time.sleep(0.1)  # Let the follower join the in-flight call
+    release.set()
+    leader.join(timeout=5)
+    follower.join(timeout=5)
+
+    assert results == ["result", "result"]
+    assert len(calls) == 1
+
+
+def test_single_flight_propagates_errors_and_releases_key():
+    """Test that a failed call raises and the next call runs fresh"""
+    flight = SingleFlight()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        flight.do("key", fail)
+
+    assert flight.do("key", lambda: "ok") == "ok"
+
+
+def test_ttl_cache_hit_and_expiry(monkeypatch):
+    """Test exact-key lookups and TTL expiry"""
+    cache = TTLCache(ttl=10)
+    now = [1000.0]
+    monkeypatch.setattr("src.services.rag_cache.time.time", lambda: now[0])
+
+    cache.put("key", "result")
+    assert cache.get("key") == "result"
+    assert cache.get("other") is None
+
+    now[0] += 11
+    assert cache.get("key") is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    """Test LRU eviction when the exact-key cache is full"""
+    cache = TTLCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_ttl_cache_stats_count_hits_and_misses():
+    """Test that exact-key lookups are counted in stats()"""
+    cache = TTLCache()
+    assert cache.stats()["hit_rate"] == 0.0
+
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("a")
+    cache.get("b")
+
+    assert cache.stats() == {"size": 1, "hits": 2, "misses": 1, "hit_rate": 0.667}
+
+
+def test_ttl_cache_follows_semantic_cache_clears():
+    """Test that an exact-key cache tied to a semantic cache is emptied by its clear()"""
+    semantic = SemanticCache()
+    exact = TTLCache(generation=semantic.generation)
+    exact.put("key", "result")
+    assert exact.get("key") == "result"
+
+    semantic.clear()
+
+    assert exact.get("key") is None
+
+
+def test_cache_clear_propagates_to_other_workers(tmp_path):
+    """Test that clearing one worker's caches makes another worker on the same file miss"""
+    db_path = str(tmp_path / "cache.db")
+    workers = []
+    for _ in range(2):
+        semantic = SemanticCache(db_path=db_path)
+        workers.append((semantic, TTLCache(generation=semantic.generation)))
+    (first_semantic, first_exact), (second_semantic, second_exact) = workers
+
+    first_semantic.put([1.0, 0.0], "result")
+    for semantic, exact in workers:
+        exact.put("key", "result")
+        assert semantic.get([1.0, 0.0]) == "result"
+
+    first_semantic.clear()
+    first_exact.clear()
+
+    assert second_exact.get("key") is None
+    assert second_semantic.get([1.0, 0.0]) is None
+    assert first_exact.get("key") is None
+    assert first_semantic.get([1.0, 0.0]) is None
+
+
+def test_embedding_store_round_trip_across_instances(tmp_path):
+    """Test that a stored embedding is readable from a second store on the same file"""
+    db_path = str(tmp_path / "cache.db")
+    EmbeddingStore(db_path).put(b"model:key", [0.5, -1.0, 2.0])
+
+    vector = EmbeddingStore(db_path).get(b"model:key")
+    assert list(vector) == [0.5, -1.0, 2.0]
+    assert EmbeddingStore(db_path).get(b"model:other") is None